@@ -0,0 +1,6 @@
+"""Run the command line interface (python -m iirsim)."""
+
+import sys
+from . import cli
+
+sys.exit(cli.main())
@@ -0,0 +1,256 @@
+"""State-space description, transfer function and response of the ideal filter.
+
+Without quantization, every node value is a linear combination of the values
+of the Delay nodes and of the input value. Following the schedule once with
+these combinations instead of numbers gives the state-space description of the
+filter, from which the transfer function and the frequency response follow
+without simulating the filter. The ideal response to input data can be
+computed from the matrices as well, in blocks of matrix products, or from the
+transfer function with scipy.signal.lfilter if scipy is installed and the
+filter has only a few Delay nodes.
+
+Const nodes other than the input node are treated as zero.
+"""
+
+import numpy
+from schedule import ADD
+
+try:
+    import scipy.signal as scipy_signal
+except ImportError:
+    scipy_signal = None
+
+# number of samples processed by one matrix product in _run_state_space()
+_BLOCK = 128
+
+# largest number of Delay nodes for which ideal_response() and
+# frequency_response() use the transfer function, whose polynomial
+# coefficients lose accuracy for higher orders
+_MAX_POLYNOMIAL_ORDER = 8
+
+# number of matrix elements solved at once in _state_space_frequency_response()
+_SOLVE_ELEMENTS = 1 << 20
+
+def state_space(filt):
+    """
+    Return the state-space matrices (A, B, C, D) of the ideal filter.
+
+    The state vector s holds the output values of the Delay nodes, in the order
+    of their names, u is the value of the input node and y the value of the
+    output node:
+
+    s[n+1] = A s[n] + B u[n]
+    y[n]   = C s[n] + D u[n]
+
+    A is an n-by-n matrix, B and C are vectors of length n and D is a number,
+    where n is the number of Delay nodes.
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> m = Multiply(8, 6, 5, 16) # 0.5
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8)}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+    >>> (A, B, C, D) = state_space(Filter(nodes, adjacency, 'x', 'y'))
+    >>> (A.tolist(), B.tolist(), C.tolist(), D)
+    ([[0.5]], [1.0], [0.5], 1.0)
+    """
+    return _state_space(filt._get_schedule())
+
+def ideal_response(filt, x):
+    """
+    Return the ideal response to the input node values x from the reset state.
+
+    x is a vector or a matrix with one input pulse per column. The result is
+    the same as the ideal response of the block engine, up to rounding errors.
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> m = Multiply(8, 6, 5, 16) # 0.5
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8)}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+    >>> list(ideal_response(Filter(nodes, adjacency, 'x', 'y'), [8, 0, 0, 0]))
+    [8.0, 4.0, 2.0, 1.0]
+
+    The output is delayed if the output node is a Delay node (D = 0):
+
+    >>> nodes = {'x': Const(8), 's': Add(8), 'y': Delay(8), 'm': m}
+    >>> adjacency = {'x': [], 's': ['x', 'm'], 'y': ['s'], 'm': ['y']}
+    >>> list(ideal_response(Filter(nodes, adjacency, 'x', 'y'), [8, 0, 0, 0]))
+    [0.0, 8.0, 4.0, 2.0]
+    >>> ideal_response(Filter(nodes, adjacency, 'x', 'y'), numpy.zeros((0, 2)))
+    array([], shape=(0, 2), dtype=float64)
+    """
+    x = numpy.asarray(x, dtype=float)
+    (A, B, C, D) = state_space(filt)
+    if scipy_signal is not None and 0 < len(A) <= _MAX_POLYNOMIAL_ORDER:
+        (b, a) = _transfer_function(A, B, C, D)
+        return scipy_signal.lfilter(b, a, x, axis=0)
+    return _run_state_space(A, B, C, D, x)[0]
+
+def transfer_function(filt):
+    """
+    Return the coefficients (b, a) of the transfer function of the filter.
+
+    H(z) = (b[0] + b[1] z^-1 + ... + b[n] z^-n) /
+           (a[0] + a[1] z^-1 + ... + a[n] z^-n)
+
+    where n is the number of Delay nodes and a[0] = 1. The coefficients can be
+    used with scipy.signal.lfilter and give the ideal response in units of the
+    input and output node values.
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> m = Multiply(8, 6, 5, 16) # 0.5
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8)}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+    >>> (b, a) = transfer_function(Filter(nodes, adjacency, 'x', 'y'))
+    >>> (list(b), list(a))
+    ([1.0, 0.0], [1.0, -0.5])
+    """
+    return _transfer_function(*state_space(filt))
+
+def frequency_response(filt, f, fs=1.0):
+    """
+    Return the complex frequency response of the filter at the frequencies f.
+
+    f is a number or an array of frequencies, in the same unit as the sample
+    rate fs. The response is evaluated from the transfer function for filters
+    with up to _MAX_POLYNOMIAL_ORDER Delay nodes and as C (zI - A)^-1 B + D
+    from the state-space matrices otherwise, independent of the length of any
+    impulse response.
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> m = Multiply(8, 6, 5, 16) # 0.5
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8)}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+    >>> H = frequency_response(Filter(nodes, adjacency, 'x', 'y'), [0, 0.5])
+    >>> [round(h, 6) for h in abs(H)]
+    [2.0, 0.666667]
+
+    Filters without Delay nodes have a constant frequency response:
+
+    >>> nodes = {'x': Const(8), 'm': m, 'y': Add(8)}
+    >>> adjacency = {'x': [], 'm': ['x'], 'y': ['x', 'm']}
+    >>> abs(frequency_response(Filter(nodes, adjacency, 'x', 'y'), [0, 0.5]))
+    array([1.5, 1.5])
+
+    A cascade of 16 first-order sections with unit gain at f = 0 is beyond the
+    accuracy of the polynomial coefficients, but not of the state-space form:
+
+    >>> nodes = {'x': Const(16)}
+    >>> adjacency = {'x': []}
+    >>> prev = 'x'
+    >>> for k in range(16):
+    ...     (s, d, p, g) = ['%s%i' % (c, k) for c in 'sdpg']
+    ...     nodes.update({s: Add(16), d: Delay(16),
+    ...                   p: Multiply(16, 12, 11, 1946), # 0.9502
+    ...                   g: Multiply(16, 12, 11, 102)}) # 0.0498
+    ...     adjacency.update({s: [prev, p], d: [s], p: [d], g: [s]})
+    ...     prev = g
+    >>> H = frequency_response(Filter(nodes, adjacency, 'x', prev), [0, 0.5])
+    >>> [round(h, 6) for h in abs(H)]
+    [1.0, 0.0]
+    """
+    (A, B, C, D) = state_space(filt)
+    f = numpy.asarray(f, dtype=float)
+    if len(A) > _MAX_POLYNOMIAL_ORDER:
+        z = numpy.exp(2j*numpy.pi*f/fs)
+        return _state_space_frequency_response(A, B, C, D, z)
+    (b, a) = _transfer_function(A, B, C, D)
+    z_inv = numpy.exp(-2j*numpy.pi*f/fs)
+    # polynomials in z^-1, coefficients in ascending order
+    return numpy.polyval(b[::-1], z_inv) / numpy.polyval(a[::-1], z_inv)
+
+# internally used functions
+#--------------------------------------------------------------------
+def _state_space(schedule):
+    """Return the state-space matrices of the schedule (see state_space).
+
+    The states are in the order of schedule.delays.
+    """
+    n = len(schedule.delays)
+    # coefficients of (s[0], ..., s[n-1], u) for every slot
+    rows = numpy.zeros((len(schedule.names), n + 1))
+    for (i, (slot, node, bits, in_slot)) in enumerate(schedule.delays):
+        rows[slot, i] = 1.0
+    rows[schedule.in_slot, n] = 1.0
+    for (op, slot, a, b, factor, shift, scale, offset, mask,
+         overflow, rounding) in schedule.ops:
+        if op == ADD:
+            rows[slot] = rows[a] + rows[b]
+        else:
+            rows[slot] = rows[a]*factor / scale
+    next_rows = rows[[in_slot for (slot, node, bits, in_slot)
+                      in schedule.delays]].reshape(n, n + 1)
+    out_row = rows[schedule.out_slot]
+    return (next_rows[:, :n], next_rows[:, n], out_row[:n], out_row[n])
+
+def _transfer_function(A, B, C, D):
+    """Return the transfer function (b, a) of state-space matrices."""
+    if not len(A):
+        return (numpy.array([D]), numpy.array([1.0]))
+    a = numpy.poly(A)
+    # det(zI - A + BC) = det(zI - A) * (1 + C (zI - A)^-1 B)
+    b = numpy.poly(A - numpy.outer(B, C)) + (D - 1)*a
+    return (b, a)
+
+def _state_space_frequency_response(A, B, C, D, z):
+    """Return C (zI - A)^-1 B + D for every value in z.
+
+    The linear systems are solved in blocks of about _SOLVE_ELEMENTS matrix
+    elements. Where zI - A is singular, the response is infinite.
+    """
+    n = len(A)
+    flat = z.ravel()
+    H = numpy.empty(flat.shape, dtype=complex)
+    step = max(1, _SOLVE_ELEMENTS // (n*n))
+    for start in range(0, len(flat), step):
+        M = flat[start:start+step, None, None]*numpy.eye(n) - A
+        rhs = numpy.tile(B[:, None], (len(M), 1, 1))
+        try:
+            v = numpy.linalg.solve(M, rhs)[..., 0]
+        except numpy.linalg.LinAlgError:
+            v = numpy.empty(rhs.shape[:2], dtype=complex)
+            for (i, (Mi, ri)) in enumerate(zip(M, rhs)):
+                try:
+                    v[i] = numpy.linalg.solve(Mi, ri)[:, 0]
+                except numpy.linalg.LinAlgError:
+                    v[i] = numpy.inf
+        H[start:start+step] = v.dot(C) + D
+    return H.reshape(z.shape)
+
+def _run_state_space(A, B, C, D, x, s=None):
+    """
+    Return the response to x and the final state, starting from the state s
+    (default: zero).
+
+    The samples are processed in blocks of L = _BLOCK samples: for the state s
+    at the start of a block and the inputs u of the block, the outputs are
+    O s + T u and the state at the end is A^L s + G u, where the rows of O are
+    C A^k, T is the lower triangular Toeplitz matrix of the impulse response
+    and the columns of G are A^k B.
+    """
+    n = len(A)
+    columns = x.reshape(len(x), x.shape[1] if x.ndim > 1 else 1)
+    if s is None:
+        s = numpy.zeros((n, columns.shape[1]))
+    L = max(1, min(_BLOCK, len(x)))
+
+    powers = numpy.empty((L + 1, n, n)) # A^0 ... A^L
+    powers[0] = numpy.eye(n)
+    for k in range(L):
+        powers[k+1] = powers[k].dot(A)
+    O = numpy.dot(powers[:L].transpose(0, 2, 1), C)      # C A^k
+    G = numpy.dot(powers[L-1::-1], B).T                   # A^(L-1-j) B
+    h = numpy.concatenate([[D], O[:L-1].dot(B)])          # impulse response
+    i = numpy.arange(L)
+    T = numpy.where(i[:, None] >= i, h[i[:, None] - i], 0.0)
+
+    y = numpy.empty(columns.shape)
+    for start in range(0, len(x), L):
+        u = columns[start:start+L]
+        r = len(u)
+        y[start:start+r] = O[:r].dot(s) + T[:r, :r].dot(u)
+        s = powers[r].dot(s) + G[:, L-r:].dot(u)
+    return (y.reshape(x.shape), s)
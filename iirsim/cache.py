@@ -0,0 +1,114 @@
+"""Memoization of filter responses.
+
+A ResponseCache remembers the responses of the last few simulations, keyed on
+the fingerprint of the filter (structure, node types, bits and factors), a hash
+of the input data and the remaining arguments. Asking for the same response
+again returns the stored result without simulating the filter. The state the
+filter was left in is stored as well and restored on a hit, so that the filter
+continues the same way after a cached response as after a simulated one.
+"""
+
+import collections, hashlib
+import numpy
+
+class ResponseCache():
+    """
+    Least recently used cache for filter responses.
+
+    >>> from nodes import Const, Add, Delay
+    >>> from filter import Filter
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'y': Add(8)}
+    >>> filt = Filter(nodes, {'x': [], 'd': ['x'], 'y': ['x', 'd']}, 'x', 'y')
+    >>> c = ResponseCache(maxsize=2)
+    >>> list(c.response_dual(filt, [1, 2, 3], 3)[1])
+    [1, 3, 5]
+    >>> filt.reset()
+    >>> list(c.response_dual(filt, [1, 2, 3], 3)[1])
+    [1, 3, 5]
+    >>> (c.hits, c.misses)
+    (1, 1)
+
+    The filter is left in the same state as without the cache:
+
+    >>> list(filt.process([0, 0]))
+    [3, 0]
+
+    A computation that was cancelled is not stored:
+
+    >>> c.response_dual(filt, [4], 1, compute=lambda: None) is None
+    True
+    >>> len(c)
+    1
+    """
+    def __init__(self, maxsize=32):
+        """Set the maximum number of stored responses."""
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        """Remove all stored responses and reset the counters."""
+        self._responses = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._responses)
+
+    def response_block(self, filt, data, length, norm=False, ideal=False,
+                       incremental=False):
+        """Return filt.response_block(...), from the cache if possible."""
+        key = ('block', _data_hash(data), length, norm, ideal)
+        return self._get(filt, key, lambda: filt.response_block(
+                         data, length, norm, ideal, incremental))
+
+    def response_dual(self, filt, data, length, norm=False,
+                      incremental=False, compute=None):
+        """Return filt.response_dual(...), from the cache if possible.
+
+        If compute is given, it is called instead of filt.response_dual() on a
+        miss and must return the same result, or None if it was cancelled, in
+        which case None is returned and nothing is stored.
+        """
+        key = ('dual', _data_hash(data), length, norm)
+        if compute is None:
+            compute = lambda: filt.response_dual(data, length, norm,
+                                                 incremental)
+        return self._get(filt, key, compute)
+
+    def _get(self, filt, key, compute):
+        """Return a copy of the stored result or compute and store it.
+
+        On a hit, the filter is set to the state it was left in by computing
+        the result.
+        """
+        key = (filt.fingerprint(),) + key
+        if key in self._responses:
+            self.hits += 1
+            (result, state) = self._responses.pop(key)
+            filt.set_state(state)
+        else:
+            self.misses += 1
+            result = compute()
+            if result is None:
+                return None
+            state = filt.get_state()
+            while self._responses and len(self._responses) >= self.maxsize:
+                self._responses.popitem(last=False)
+        if self.maxsize > 0:
+            self._responses[key] = (result, state)
+        return _copy(result)
+
+# internally used functions
+#--------------------------------------------------------------------
+def _data_hash(data):
+    """Return a hash of the values of an array."""
+    data = numpy.ascontiguousarray(data)
+    h = hashlib.sha1(data.view(numpy.uint8))
+    return (data.dtype.str, data.shape, h.hexdigest())
+
+def _copy(result):
+    """Copy arrays so that the stored result cannot be changed."""
+    if isinstance(result, tuple):
+        return tuple(numpy.copy(r) for r in result)
+    else:
+        return numpy.copy(result)
@@ -1,41 +1,181 @@
-import shlex, os, numpy
+import re, os, time, struct, hashlib, collections, numpy
+from core import OVERFLOW_POLICIES, ROUNDING_MODES
 from nodes import Const, Add, Multiply, Delay
 from filter import Filter
 
 def load_filter(filename):
-    """Read configuration file and return a filter."""
-    # parse config file
-    if not os.path.isfile(filename):
-        raise IOError('File "%s" does not exist' % filename)
+    """Read configuration file and return a filter.
+
+    The file is either a text configuration file or a binary snapshot written
+    by save_filter(..., binary=True). The parsed contents of the file are
+    cached. Loading the same file again only makes a new filter from the
+    cache, unless the file has changed.
+    """
+    return _load_filter(filename)
+
+def save_filter(filt, filename, binary=False):
+    """Write a filter to a configuration file that load_filter() can read.
+
+    The number of bits, factor bits and norm bits, the factors, connections
+    and the input and output node are stored, the state of the filter is not.
+    If binary is True, a compact binary snapshot is written instead of text.
+
+    >>> import tempfile
+    >>> nodes = {'x': Const(12), 'd': Delay(12), 'y': Add(12, 'saturate'),
+    ...          'm': Multiply(12, 8, 6, 40, 'raise', 'convergent'),
+    ...          'n': Multiply(12, 6, 5, -7, rounding='nearest')}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'n': ['m'],
+    ...              'y': ['x', 'n']}
+    >>> filt = Filter(nodes, adjacency, 'x', 'y')
+    >>> (fd, name) = tempfile.mkstemp('.fil')
+    >>> os.close(fd)
+    >>> save_filter(filt, name)
+    >>> load_filter(name).fingerprint() == filt.fingerprint()
+    True
+    >>> save_filter(filt, name, binary=True)
+    >>> load_filter(name).fingerprint() == filt.fingerprint()
+    True
+    >>> unpack_filter(pack_filter(filt)).fingerprint() == filt.fingerprint()
+    True
+    >>> os.remove(name)
+    """
+    spec = _get_spec(filt)
+    if binary:
+        contents = _pack_spec(spec)
+    else:
+        contents = _format_filter(spec)
     try:
-        f = open(filename)
+        f = open(filename, 'wb')
     except IOError:
         raise IOError('Could not open file "%s"' % filename)
+    try:
+        f.write(contents)
+    finally:
+        f.close()
 
-    cfg_items = []
-    for (i, line) in enumerate(f):
+def pack_filter(filt):
+    """Return a binary snapshot of a filter as a string (see save_filter)."""
+    return _pack_spec(_get_spec(filt))
+
+def unpack_filter(data):
+    """Return a new filter from a string returned by pack_filter()."""
+    return _make_filter(_unpack_spec(data, '<string>'))
+
+def clear_filter_cache():
+    """Forget all parsed configuration files."""
+    _filter_cache.clear()
+
+# parsed configuration files: path -> ((mtime, size), content hash, spec)
+_filter_cache = collections.OrderedDict()
+_FILTER_CACHE_SIZE = 64
+
+def _load_filter(filename):
+    """
+    Return a new filter from a file, parsing it if necessary.
+
+    The specification is only cached after a filter has been made from it, so
+    that invalid files are not cached.
+
+    >>> import tempfile
+    >>> (fd, name) = tempfile.mkstemp('.fil')
+    >>> text = ('bits_global 8\\nfactor_bits_global 6\\nnorm_bits_global 5\\n'
+    ...         'node Const, name "x", input\\n'
+    ...         'node Multiply, name "m", connect "x", factor 0.50, output\\n')
+    >>> f = os.fdopen(fd, 'w'); f.write(text); f.close()
+    >>> load_filter(name).factors(norm=True)
+    {'m': 0.5}
+    >>> f = open(name, 'w'); f.write(text.replace('0.50', '0.25')); f.close()
+    >>> load_filter(name).factors(norm=True)
+    {'m': 0.25}
+    >>> os.path.abspath(name) in _filter_cache
+    True
+    >>> f = open(name, 'w'); f.write(text.replace('0.50', '1.50')); f.close()
+    >>> load_filter(name) # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    ValueError: ...
+    >>> os.path.abspath(name) in _filter_cache
+    False
+    >>> clear_filter_cache()
+    >>> len(_filter_cache)
+    0
+    >>> os.remove(name)
+    """
+    if not os.path.isfile(filename):
+        raise IOError('File "%s" does not exist' % filename)
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    stat_key = (stat.st_mtime, stat.st_size)
+    if stat.st_mtime >= time.time() - 2:
+        # the file could be changed again without changing mtime and size,
+        # so the contents are compared the next time
+        stat_key = None
+    cached = _filter_cache.pop(path, None)
+    if cached is not None and stat_key is not None and cached[0] == stat_key:
+        spec = cached[2]
+        digest = cached[1]
+    else:
         try:
-            # remove all comments and unnecessary whitespace
-            normalizer = shlex.shlex(line)
-            normalizer.wordchars += '.-'
-            normal_line = ' '.join([t for t in normalizer])
-            if normal_line:
-                # split up normalized line and build dictionary
-                cfg_item = {}
-                for part in normal_line.split(','):
-                    cfg_split = shlex.split(part)
-                    key = cfg_split.pop(0)
-                    value = cfg_split
-                    cfg_item[key] = value
-                cfg_items.append(cfg_item)
-        except (IndexError, ValueError):
-            raise RuntimeError( \
-                'Could not parse line %i of file "%s"' % (i, filename))
+            f = open(filename, 'rb')
+            try:
+                text = f.read()
+            finally:
+                f.close()
+        except IOError:
+            raise IOError('Could not open file "%s"' % filename)
+        digest = hashlib.sha1(text).hexdigest()
+        if cached is not None and cached[1] == digest:
+            spec = cached[2]
+        else:
+            if text.startswith(_FILTER_MAGIC):
+                spec = _unpack_spec(text, filename)
+            else:
+                spec = _parse_filter(text, filename)
+    filt = _make_filter(spec)
+    _filter_cache[path] = (stat_key, digest, spec)
+    while len(_filter_cache) > _FILTER_CACHE_SIZE:
+        _filter_cache.popitem(last=False)
+    return filt
+
+def _make_filter(spec):
+    """Make a filter from a specification (see _parse_filter)."""
+    (nodes, adjacency, input_node, output_node) = spec
+    filter_nodes = {}
+    for (name, node, bits, factor_bits, norm_bits, factor, overflow,
+         rounding) in nodes:
+        if node == 'Const':
+            filter_nodes[name] = Const(bits)
+        elif node == 'Add':
+            filter_nodes[name] = Add(bits, overflow)
+        elif node == 'Delay':
+            filter_nodes[name] = Delay(bits)
+        elif node == 'Multiply':
+            filter_nodes[name] = Multiply(bits, factor_bits, norm_bits,
+                                          overflow=overflow, rounding=rounding)
+            if factor is not None:
+                filter_nodes[name].set_factor(factor, norm=True)
+    return Filter(filter_nodes,
+                  dict((name, list(connect)) for (name, connect) in adjacency),
+                  input_node, output_node)
+
+def _parse_filter(text, filename):
+    """
+    Parse the contents of a configuration file.
+
+    Returns the specification of the filter: a tuple of node descriptions
+    (name, type, bits, factor_bits, norm_bits, normalized factor, overflow
+    policy, rounding mode), the
+    connections as (name, input names) pairs, and the names of the input and
+    the output node.
+    """
+    cfg_items = _parse_items(text, filename)
 
     # look for global bit settings
     bits_global        = None
     factor_bits_global = None
     norm_bits_global  = None
+    overflow_global    = None
+    rounding_global    = None
     for cfg_item in cfg_items:
         if 'bits_global' in cfg_item:
             if bits_global is None:
@@ -58,13 +198,36 @@ def load_filter(filename):
             else:
                 raise RuntimeError( \
                     'norm_bits_global must not be specified more than once')
+        if 'overflow_global' in cfg_item:
+            if overflow_global is None:
+                [overflow_global] = cfg_item.pop('overflow_global')
+                if overflow_global not in OVERFLOW_POLICIES:
+                    raise RuntimeError('Unknown overflow policy: %s'
+                                       % overflow_global)
+            else:
+                raise RuntimeError( \
+                    'overflow_global must not be specified more than once')
+        if 'rounding_global' in cfg_item:
+            if rounding_global is None:
+                [rounding_global] = cfg_item.pop('rounding_global')
+                if rounding_global not in ROUNDING_MODES:
+                    raise RuntimeError('Unknown rounding mode: %s'
+                                       % rounding_global)
+            else:
+                raise RuntimeError( \
+                    'rounding_global must not be specified more than once')
+    if overflow_global is None:
+        overflow_global = 'wrap'
+    if rounding_global is None:
+        rounding_global = 'floor'
 
     # remove empty items from cfg_items, only node definitions should be left
     cfg_items = filter(None, cfg_items)
 
     # look for filter nodes
-    filter_nodes = {}
-    adjacency    = {}
+    filter_nodes = []
+    adjacency    = []
+    names        = set()
     input_node   = None
     output_node  = None
     for cfg_item in cfg_items:
@@ -97,16 +260,24 @@ def load_filter(filename):
             else:
                 raise RuntimeError('More than one output node specified')
 
-        # make filter node
-        if name not in filter_nodes:
+        # describe filter node
+        if name not in names:
+            factor_bits = None
+            norm_bits = None
+            factor = None
+            overflow = None
+            rounding = None
             if bits is not None:
-                if node == 'Const':
-                    filter_nodes[name] = Const(bits)
-                elif node == 'Add':
-                    filter_nodes[name] = Add(bits)
-                elif node == 'Delay':
-                    filter_nodes[name] = Delay(bits)
-                elif node == 'Multiply':
+                if node in ['Add', 'Multiply']:
+                    if 'overflow' in cfg_item:
+                        [overflow] = cfg_item['overflow']
+                        if overflow not in OVERFLOW_POLICIES:
+                            raise RuntimeError( \
+                                'Unknown overflow policy for node "%s": %s'
+                                % (name, overflow))
+                    else:
+                        overflow = overflow_global
+                if node == 'Multiply':
                     if 'factor_bits' in cfg_item:
                         [factor_bits] = cfg_item['factor_bits']
                         factor_bits = int(factor_bits)
@@ -117,47 +288,438 @@ def load_filter(filename):
                         norm_bits = int(norm_bits)
                     else:
                         norm_bits = norm_bits_global
-                    if (factor_bits is not None and norm_bits is not None):
-                        filter_nodes[name] = Multiply(
-                                               bits, factor_bits, norm_bits)
+                    if (factor_bits is None or norm_bits is None):
+                        raise RuntimeError( \
+                            'Number of factor bits for node "%s" not specified'
+                            % name)
                     if 'factor' in cfg_item:
                         [factor] = cfg_item['factor']
                         factor = float(factor)
-                        filter_nodes[name].set_factor(factor, norm=True)
-                else:
+                    if 'rounding' in cfg_item:
+                        [rounding] = cfg_item['rounding']
+                        if rounding not in ROUNDING_MODES:
+                            raise RuntimeError( \
+                                'Unknown rounding mode for node "%s": %s'
+                                % (name, rounding))
+                    else:
+                        rounding = rounding_global
+                elif node not in ['Const', 'Add', 'Delay']:
                     raise ValueError('Unknown node type: %s' % node)
             else:
                 raise RuntimeError('Number of bits for node "%s" not specified' \
                                    % name)
-            adjacency[name] = connect
+            names.add(name)
+            filter_nodes.append((name, node, bits, factor_bits, norm_bits,
+                                 factor, overflow, rounding))
+            adjacency.append((name, tuple(connect)))
         else:
             raise RuntimeError('Node "%s" already present' % name)
 
-    # make filter
+    # make filter specification
     if input_node is None:
         raise RuntimeError('No input node specified')
     elif output_node is None:
         raise RuntimeError('No output node specified')
     else:
-        return Filter(filter_nodes, adjacency, input_node, output_node)
+        return (tuple(filter_nodes), tuple(adjacency), input_node, output_node)
+
+# tokens of configuration files, anything else is an error
+_TOKEN = re.compile(r"""
+    [ \t\r\f\v]*
+    (?:
+        (?P<newline>(?:\#[^\n]*)?(?:\n|\Z))
+      | (?P<comma>,)
+      | (?P<word>[\w.\-]+)
+      | "(?P<dquote>[^"\n]*)"
+      | '(?P<squote>[^'\n]*)'
+      | (?P<error>.)
+    )
+""", re.VERBOSE)
+
+def _parse_items(text, filename):
+    """
+    Split the contents of a configuration file into items.
+
+    Each non-empty line is a comma separated list of a key followed by any
+    number of words or quoted strings, and becomes a dictionary mapping each
+    key to the list of its values. The text is scanned only once, errors are
+    reported with line and column.
+
+    >>> _parse_items('node Add, name "a", connect "b" c # comment\\n', 'f')
+    [{'node': ['Add'], 'name': ['a'], 'connect': ['b', 'c']}]
+    >>> _parse_items('node Add, , name "a"', 'f')
+    Traceback (most recent call last):
+    ...
+    RuntimeError: Could not parse line 1, column 11 of file "f": expected key
+    """
+    cfg_items = []
+    item = None   # dictionary of the current line
+    values = None # values of the current key, None if a key is expected
+    line = 1
+    line_start = 0
+    for match in _TOKEN.finditer(text):
+        kind = match.lastgroup
+        start = match.start(kind)
+        if kind == 'newline':
+            if item is None or values is not None:
+                if item is not None:
+                    cfg_items.append(item)
+                item = values = None
+                line += 1
+                line_start = match.end()
+                continue
+            message = 'expected key'
+        elif kind == 'comma':
+            if values is not None:
+                values = None
+                continue
+            message = 'expected key'
+        elif kind == 'error':
+            if match.group(kind) in '"\'':
+                message = 'no closing quotation'
+            else:
+                message = 'unexpected character %r' % match.group(kind)
+        elif values is not None:
+            values.append(match.group(kind))
+            continue
+        elif kind == 'word':
+            if item is None:
+                item = {}
+            values = item[match.group(kind)] = []
+            continue
+        else:
+            start -= 1 # opening quotation mark
+            message = 'expected key'
+        raise RuntimeError( \
+            'Could not parse line %i, column %i of file "%s": %s'
+            % (line, start - line_start + 1, filename, message))
+    return cfg_items
+
+def _get_spec(filt):
+    """Return the specification of a filter (see _parse_filter)."""
+    nodes = []
+    adjacency = []
+    for name in filt._get_schedule().names:
+        node = filt._nodes[name]
+        if isinstance(node, Multiply):
+            nodes.append((name, 'Multiply', node.bits(), node._factor_bits,
+                          node._norm_bits, node.factor(norm=True),
+                          node.overflow(), node.rounding()))
+        elif isinstance(node, Add):
+            nodes.append((name, 'Add', node.bits(), None, None, None,
+                          node.overflow(), None))
+        else:
+            nodes.append((name, node.__class__.__name__, node.bits(),
+                          None, None, None, None, None))
+        adjacency.append((name, tuple(filt._adjacency[name])))
+    return (tuple(nodes), tuple(adjacency), filt._in_name, filt._out_name)
+
+def _format_filter(spec):
+    """
+    Return the text of a configuration file for a filter specification.
+
+    The most common numbers of bits, factor bits and norm bits, overflow
+    policy and rounding mode are written as global settings, nodes only get
+    their own settings where they differ.
+    """
+    (nodes, adjacency, input_node, output_node) = spec
+    connections = dict(adjacency)
+    for name in connections:
+        if '"' in name or '\n' in name:
+            raise ValueError('Node name %r cannot be written' % name)
 
-def save_filter(filt, filename):
-    for name in filt._nodes.iterkeys():
-        print name # TODO
+    def most_common(values):
+        return max(sorted(set(values)), key=values.count)
+    bits_global = most_common([n[2] for n in nodes])
+    multiply = [n for n in nodes if n[1] == 'Multiply']
+    lines = ['bits_global        %i' % bits_global]
+    if multiply:
+        factor_bits_global = most_common([n[3] for n in multiply])
+        norm_bits_global = most_common([n[4] for n in multiply])
+        lines += ['factor_bits_global %i' % factor_bits_global,
+                  'norm_bits_global   %i' % norm_bits_global]
+    overflow_global = 'wrap'
+    policies = [n[6] for n in nodes if n[6] is not None]
+    if policies and most_common(policies) != 'wrap':
+        overflow_global = most_common(policies)
+        lines.append('overflow_global    %s' % overflow_global)
+    rounding_global = 'floor'
+    modes = [n[7] for n in multiply]
+    if modes and most_common(modes) != 'floor':
+        rounding_global = most_common(modes)
+        lines.append('rounding_global    %s' % rounding_global)
+    lines.append('')
+
+    width = max(len(n[0]) for n in nodes) + 3
+    for (name, node, bits, factor_bits, norm_bits, factor, overflow,
+         rounding) in nodes:
+        parts = ['node %-9s name %s' % (node + ',',
+                                        ('"%s",' % name).ljust(width))]
+        if connections[name]:
+            parts.append('connect %s,' % ' '.join('"%s"' % n
+                                                  for n in connections[name]))
+        if bits != bits_global:
+            parts.append('bits %i,' % bits)
+        if node == 'Multiply':
+            if factor_bits != factor_bits_global:
+                parts.append('factor_bits %i,' % factor_bits)
+            if norm_bits != norm_bits_global:
+                parts.append('norm_bits %i,' % norm_bits)
+            parts.append('factor %r,' % factor)
+            if rounding != rounding_global:
+                parts.append('rounding %s,' % rounding)
+        if overflow is not None and overflow != overflow_global:
+            parts.append('overflow %s,' % overflow)
+        if name == input_node:
+            parts.append('input,')
+        if name == output_node:
+            parts.append('output,')
+        lines.append(' '.join(parts).rstrip(' ,'))
+    return '\n'.join(lines) + '\n'
+
+# binary filter snapshots: header, one record per node, node names
+_FILTER_MAGIC = 'IIRSIMF1'
+_FILTER_HEADER = struct.Struct('<8sIIII') # magic, nodes, input, output, names
+_FILTER_NODE = struct.Struct('<BiiiqiiBB') # type, bits, factor_bits,
+                                           # norm_bits, factor, inputs (-1: not
+                                           # connected), overflow policy,
+                                           # rounding mode
+_NODE_TYPES = ['Const', 'Add', 'Multiply', 'Delay']
+
+def _pack_spec(spec):
+    """Return a binary snapshot of a filter specification."""
+    (nodes, adjacency, input_node, output_node) = spec
+    names = [n[0] for n in nodes]
+    for name in names:
+        if '\n' in name:
+            raise ValueError('Node name %r cannot be written' % name)
+    index = dict((name, i) for (i, name) in enumerate(names))
+    connections = dict(adjacency)
+    names = '\n'.join(names)
+    records = [_FILTER_HEADER.pack(_FILTER_MAGIC, len(nodes),
+                                   index[input_node], index[output_node],
+                                   len(names))]
+    for (name, node, bits, factor_bits, norm_bits, factor, overflow,
+         rounding) in nodes:
+        inputs = [index[n] for n in connections[name]] + [-1, -1]
+        if node == 'Multiply':
+            factor = int(round(factor * (1 << norm_bits)))
+        else:
+            (factor_bits, norm_bits, factor) = (0, 0, 0)
+        overflow = 0 if overflow is None else OVERFLOW_POLICIES.index(overflow)
+        rounding = 0 if rounding is None else ROUNDING_MODES.index(rounding)
+        records.append(_FILTER_NODE.pack(_NODE_TYPES.index(node), bits,
+                                         factor_bits, norm_bits, factor,
+                                         inputs[0], inputs[1], overflow,
+                                         rounding))
+    records.append(names)
+    return ''.join(records)
+
+def _unpack_spec(data, filename):
+    """Return the filter specification stored in a binary snapshot."""
+    try:
+        (magic, count, input_node, output_node, names_size) = \
+            _FILTER_HEADER.unpack_from(data)
+        offset = _FILTER_HEADER.size + count*_FILTER_NODE.size
+        if magic != _FILTER_MAGIC or len(data) != offset + names_size:
+            raise ValueError
+        names = data[offset:].split('\n')
+        nodes = []
+        adjacency = []
+        for i in range(count):
+            (node, bits, factor_bits, norm_bits, factor, a, b, overflow,
+             rounding) = \
+                _FILTER_NODE.unpack_from(data, _FILTER_HEADER.size +
+                                         i*_FILTER_NODE.size)
+            node = _NODE_TYPES[node]
+            if node == 'Multiply':
+                factor = float(factor) / (1 << norm_bits)
+                rounding = ROUNDING_MODES[rounding]
+            else:
+                (factor_bits, norm_bits, factor) = (None, None, None)
+                rounding = None
+            if node in ['Add', 'Multiply']:
+                overflow = OVERFLOW_POLICIES[overflow]
+            else:
+                overflow = None
+            nodes.append((names[i], node, bits, factor_bits, norm_bits,
+                          factor, overflow, rounding))
+            adjacency.append((names[i], tuple(names[j] for j in (a, b)
+                                              if j >= 0)))
+        return (tuple(nodes), tuple(adjacency),
+                names[input_node], names[output_node])
+    except (struct.error, ValueError, IndexError):
+        raise RuntimeError('Invalid filter snapshot "%s"' % filename)
+
+# binary pulse files: header followed by the data matrix in column-major order
+_DATA_MAGIC = 'IIRSIMP1'
+_DATA_HEADER = struct.Struct('<8s8sQQi') # magic, dtype, rows, columns, norm
+_DATA_OFFSET = 64
 
 def read_data(filename):
+    """Read a pulse file (text or binary) and return an n-by-m matrix.
+
+    Text files are read with numpy.loadtxt, binary files (see write_data) are
+    memory-mapped, so that only the parts that are accessed are read.
+    """
     if not os.path.isfile(filename):
         raise IOError('File "%s" does not exist' % filename)
+    header = _read_data_header(filename)
     try:
-        x = numpy.loadtxt(filename)
-        if len(x.shape) == 1:
-            x = x.reshape(len(x), 1) # make n-by-1 matrix out of vector
-    except IOError:
+        if header is not None:
+            (dtype, rows, columns, norm_bits) = header
+            if rows * columns:
+                x = numpy.memmap(filename, dtype, 'r', _DATA_OFFSET,
+                                 (rows, columns), 'F')
+            else:
+                x = numpy.zeros((rows, columns), dtype)
+        else:
+            x = numpy.loadtxt(filename)
+            if len(x.shape) == 1:
+                x = x.reshape(len(x), 1) # make n-by-1 matrix out of vector
+    except (IOError, ValueError):
         raise IOError('Could not read data from file "%s"' % filename)
     if not len(x):
         raise IOError('File "%s" contains no data' % filename)
     return x
 
+class PulseFile():
+    """
+    Lazy access to the pulses (columns) of a pulse file.
+
+    For binary pulse files, the data is memory-mapped and each pulse is stored
+    contiguously, so opening the file is instant and only the pulses that are
+    accessed are read from disk. Text files have to be parsed completely,
+    which is done when the first pulse is accessed.
+
+    pulses[i] returns pulse i as vector, pulses[i:j] returns the pulses i to
+    j-1 as matrix with one pulse per column.
+    """
+    def __init__(self, filename):
+        """Open a pulse file."""
+        if not os.path.isfile(filename):
+            raise IOError('File "%s" does not exist' % filename)
+        self.filename = filename
+        header = _read_data_header(filename)
+        if header is not None:
+            self.norm_bits = header[3]
+            self._data = read_data(filename)
+            self._num_pulses = self._data.shape[1]
+        else:
+            self.norm_bits = None
+            self._data = None
+            self._num_pulses = _count_text_columns(filename)
+
+    def __len__(self):
+        """Return the number of pulses."""
+        return self._num_pulses
+
+    def __getitem__(self, index):
+        """Return one pulse (vector) or several pulses (matrix)."""
+        if self._data is None:
+            self._data = read_data(self.filename)
+        if isinstance(index, slice):
+            return self._data[:, index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('pulse index out of range')
+        return self._data[:, index]
+
+    def samples(self):
+        """Return the number of samples per pulse."""
+        if self._data is None:
+            self._data = read_data(self.filename)
+        return self._data.shape[0]
+
+def read_norm_bits(filename):
+    """Return the number of bits stored in a binary pulse file, or None."""
+    header = _read_data_header(filename)
+    if header is not None:
+        return header[3]
+
+def write_data(filename, x, norm_bits=None, dtype=None):
+    """Write an n-by-m matrix (or a vector) to a binary pulse file.
+
+    norm_bits is the number of bits of the (not normalized) data, which is
+    stored in the file header. dtype is the data type used in the file
+    (default: the data type of x).
+    """
+    x = numpy.asarray(x, dtype)
+    if x.ndim == 1:
+        x = x.reshape(len(x), 1)
+    dtype = x.dtype.newbyteorder('<')
+    header = _DATA_HEADER.pack(_DATA_MAGIC, dtype.str, x.shape[0], x.shape[1],
+                               -1 if norm_bits is None else norm_bits)
+    try:
+        f = open(filename, 'wb')
+    except IOError:
+        raise IOError('Could not open file "%s"' % filename)
+    try:
+        f.write(header.ljust(_DATA_OFFSET, '\0'))
+        f.write(numpy.asfortranarray(x, dtype).tostring(order='F'))
+    finally:
+        f.close()
+
+def convert_data(filename, binary_filename, norm_bits=None, dtype=None):
+    """Convert a text pulse file to a binary pulse file."""
+    write_data(binary_filename, read_data(filename), norm_bits, dtype)
+
+def _count_text_columns(filename):
+    """
+    Return the number of pulses in a text file: the number of values in the
+    first data line, or 1 if there is only one data line, which read_data()
+    reads as a single pulse.
+
+    >>> import tempfile
+    >>> (fd, name) = tempfile.mkstemp('.txt')
+    >>> f = os.fdopen(fd, 'w'); f.write('# comment\\n1 2 3\\n'); f.close()
+    >>> (len(PulseFile(name)), read_data(name).shape)
+    (1, (3, 1))
+    >>> f = open(name, 'w'); f.write('1 2 3\\n4 5 6\\n'); f.close()
+    >>> (len(PulseFile(name)), read_data(name).shape)
+    (3, (2, 3))
+    >>> os.remove(name)
+    """
+    try:
+        f = open(filename)
+    except IOError:
+        raise IOError('Could not open file "%s"' % filename)
+    try:
+        columns = None
+        for line in f:
+            values = line.split('#')[0].split()
+            if values and columns is not None:
+                return columns
+            elif values:
+                columns = len(values)
+    finally:
+        f.close()
+    if columns is None:
+        raise IOError('File "%s" contains no data' % filename)
+    return 1
+
+def _read_data_header(filename):
+    """Return dtype, rows, columns and norm_bits of a binary pulse file.
+
+    Returns None if the file is not a binary pulse file.
+    """
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        raise IOError('Could not open file "%s"' % filename)
+    try:
+        header = f.read(_DATA_HEADER.size)
+    finally:
+        f.close()
+    if len(header) < _DATA_HEADER.size or \
+       not header.startswith(_DATA_MAGIC):
+        return None
+    (magic, dtype, rows, columns, norm_bits) = _DATA_HEADER.unpack(header)
+    if norm_bits < 0:
+        norm_bits = None
+    return (numpy.dtype(dtype.rstrip('\0')), rows, columns, norm_bits)
+
 
 if __name__=='__main__':
     load_filter('directForm2.txt')
@@ -0,0 +1,203 @@
+"""Command line interface to simulate filters without the GUI.
+
+python -m iirsim run FILTER [FILTER ...] PULSES [options]
+
+simulates the response of each filter to the pulses in the pulse file and
+writes the responses to a .npy file (or as text). Neither Qt nor a display is
+needed. Run python -m iirsim run --help for the options.
+"""
+
+import sys, argparse, multiprocessing
+import numpy
+import cfg, parallel
+
+def run(filter_files, pulse_file, length=None, ideal=False, pulses=None,
+        norm_bits=None, processes=None):
+    """
+    Return the responses of several filters to the pulses of a pulse file.
+
+    filter_files: List of filter definition files (see cfg.load_filter).
+
+    pulse_file:   Pulse file (see cfg.read_data), one pulse per column.
+
+    length:       Number of output samples (default: samples per pulse).
+
+    ideal:        If True, the ideal response is computed instead of the
+                  fixed point response.
+
+    pulses:       List of pulse indices, starting at 0 (default: all pulses).
+                  The responses are in the same order, an index given twice
+                  gives the same response twice.
+
+    norm_bits:    Number of bits of the pulse data. The data is divided by
+                  2**(norm_bits-1) to normalize it. By default, the number of
+                  bits stored in binary pulse files is used and the data in
+                  text files is assumed to be normalized.
+
+    processes:    Number of worker processes (default: number of CPUs). If 1,
+                  no worker processes are started.
+
+    Returns an array of normalized output values with the shape
+    (len(filter_files), length, len(pulses)).
+
+    >>> import os, tempfile
+    >>> (fd, filter_file) = tempfile.mkstemp('.fil')
+    >>> f = os.fdopen(fd, 'w')
+    >>> f.write('bits_global 8\\nfactor_bits_global 6\\nnorm_bits_global 5\\n'
+    ...         'node Const, name "x", input\\n'
+    ...         'node Multiply, name "m", connect "x", factor 0.5, output\\n')
+    >>> f.close()
+    >>> (fd, pulse_file) = tempfile.mkstemp('.bpul')
+    >>> os.close(fd)
+    >>> cfg.write_data(pulse_file, [[64, 32], [-64, 16]], norm_bits=8)
+    >>> y = run([filter_file], pulse_file, 3, pulses=[1, 0, 1], processes=1)
+    >>> y.shape
+    (1, 3, 3)
+    >>> y[0].T.tolist() # responses to the pulses 1, 0, 1
+    [[0.125, 0.0625, 0.0], [0.25, -0.25, 0.0], [0.125, 0.0625, 0.0]]
+
+    Data that is not normalized most likely overflows the input node:
+
+    >>> cfg.write_data(pulse_file, [[64, 32], [-64, 16]])
+    >>> y = run([filter_file], pulse_file, processes=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: input overflow, the pulse data is not normalized (-b/--norm-bits missing?)
+    >>> os.remove(filter_file)
+    >>> os.remove(pulse_file)
+    """
+    pulse_data = cfg.PulseFile(pulse_file)
+    if pulses is None:
+        pulses = range(len(pulse_data))
+    for index in pulses:
+        if not 0 <= index < len(pulse_data):
+            raise ValueError('Pulse %i does not exist in file "%s"'
+                             % (index, pulse_file))
+    if length is None:
+        length = pulse_data.samples()
+    if norm_bits is None:
+        norm_bits = pulse_data.norm_bits
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if length < 0:
+        raise ValueError('The length must not be negative')
+    if processes < 1:
+        raise ValueError('The number of processes must be at least 1')
+
+    # each task computes the responses of one filter to a chunk of pulses
+    chunksize = max(1, -(-len(pulses) * len(filter_files) // (4*processes)))
+    tasks = [(i, start, pulses[start:start+chunksize])
+             for i in range(len(filter_files))
+             for start in range(0, len(pulses), chunksize)]
+
+    results = parallel.pool_map(_run_task, tasks, processes, _init_worker,
+                                (filter_files, pulse_file, length, ideal,
+                                 norm_bits))
+
+    y = numpy.zeros((len(filter_files), length, len(pulses)))
+    for ((i, start, indices), result) in zip(tasks, results):
+        y[i, :, start:start+len(indices)] = result
+    return y
+
+def main(argv=None):
+    """Run the command line interface and return the exit status."""
+    args = _make_parser().parse_args(argv)
+    try:
+        args.command(args)
+    except (IOError, RuntimeError, ValueError) as error:
+        sys.stderr.write('Error: %s\n' % error)
+        return 1
+    return 0
+
+# internally used functions
+#--------------------------------------------------------------------
+def _make_parser():
+    """Return the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(prog='python -m iirsim',
+        description='Simulate IIR filters without the GUI.')
+    commands = parser.add_subparsers()
+
+    run_parser = commands.add_parser('run',
+        help='compute the responses of filters to pulses',
+        description='Compute the responses of one or more filters to the '
+                    'pulses of a pulse file.')
+    run_parser.add_argument('filters', nargs='+', metavar='FILTER',
+        help='filter definition file')
+    run_parser.add_argument('pulses', metavar='PULSES',
+        help='pulse file with one pulse per column')
+    run_parser.add_argument('-n', '--length', type=_positive_int,
+        help='number of output samples (default: samples per pulse)')
+    mode = run_parser.add_mutually_exclusive_group()
+    mode.add_argument('--ideal', dest='ideal', action='store_true',
+        help='compute the ideal response')
+    mode.add_argument('--fixed', dest='ideal', action='store_false',
+        help='compute the fixed point response (default)')
+    run_parser.add_argument('-p', '--pulse', type=int, action='append',
+        dest='pulse_indices', metavar='INDEX',
+        help='simulate only this pulse (counting from 0), can be repeated')
+    run_parser.add_argument('-b', '--norm-bits', type=int,
+        help='number of bits of the pulse data (default: stored in binary '
+             'pulse files, otherwise the data is normalized)')
+    run_parser.add_argument('-j', '--processes', type=_positive_int,
+        help='number of worker processes (default: number of CPUs)')
+    run_parser.add_argument('-o', '--out', default='-',
+        help='output file: .npy for an array of shape (filters, length, '
+             'pulses), text with one column per filter and pulse otherwise '
+             '(default: text on standard output)')
+    run_parser.set_defaults(command=_run_command)
+    return parser
+
+def _positive_int(text):
+    """Convert a command line argument to an integer greater than 0."""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid int value: %r' % text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1: %r' % text)
+    return value
+
+def _run_command(args):
+    """Run the 'run' command."""
+    y = run(args.filters, args.pulses, args.length, args.ideal,
+            args.pulse_indices, args.norm_bits, args.processes)
+    if args.out.endswith('.npy'):
+        try:
+            numpy.save(args.out, y)
+        except IOError:
+            raise IOError('Could not write file "%s"' % args.out)
+        return
+    columns = y.transpose(1, 0, 2).reshape(y.shape[1], -1)
+    if args.out == '-':
+        numpy.savetxt(sys.stdout, columns)
+    else:
+        try:
+            numpy.savetxt(args.out, columns)
+        except IOError:
+            raise IOError('Could not write file "%s"' % args.out)
+
+_worker = {}
+
+def _init_worker(filter_files, pulse_file, length, ideal, norm_bits):
+    """Load the filters and the pulse file once per worker process."""
+    _worker['filters'] = [cfg.load_filter(f) for f in filter_files]
+    _worker['pulses'] = cfg.PulseFile(pulse_file)
+    _worker['length'] = length
+    _worker['ideal'] = ideal
+    _worker['norm_bits'] = norm_bits
+
+def _run_task(task):
+    """Return the responses of one filter to some pulses."""
+    (i, start, indices) = task
+    data = numpy.column_stack([_worker['pulses'][index] for index in indices])
+    norm_bits = _worker['norm_bits']
+    if norm_bits is not None:
+        data = data / float(2**(norm_bits-1))
+    try:
+        return _worker['filters'][i].response_batch(
+            data, _worker['length'], True, _worker['ideal'])
+    except ValueError as error:
+        if norm_bits is None and (numpy.abs(data) > 1).any():
+            raise ValueError('%s, the pulse data is not normalized '
+                             '(-b/--norm-bits missing?)' % error)
+        raise
@@ -1,5 +1,11 @@
 import numpy
 
+# possible ways to handle values that do not fit into the number of bits
+OVERFLOW_POLICIES = ['wrap', 'saturate', 'raise']
+
+# possible ways to round the product of a Multiply node
+ROUNDING_MODES = ['floor', 'nearest', 'convergent', 'zero']
+
 # internally used functions
 #--------------------------------------------------------------------
 def _test_int(x):
@@ -44,6 +50,65 @@ def _saturate(x, N):
     limit = 1 << (N - 1)
     return numpy.clip(x, -limit, limit - 1)
 
+def _limit(x, N, policy='wrap'):
+    """
+    Reduce integer (array) x to N bits in two's complement according to the
+    overflow policy: 'wrap', 'saturate' or 'raise' (ValueError in case of
+    overflow).
+
+    >>> [int(_limit(x, 3, 'saturate')) for x in [-5, 0, 4]]
+    [-4, 0, 3]
+    >>> _limit(4, 3, 'raise')
+    Traceback (most recent call last):
+    ...
+    ValueError: overflow
+    """
+    if policy == 'wrap':
+        return _wrap(x, N)
+    elif policy == 'saturate':
+        return _saturate(x, N)
+    elif policy == 'raise':
+        if numpy.any(_test_overflow(x, N)):
+            raise ValueError("overflow")
+        return x
+    else:
+        raise ValueError('unknown overflow policy: %s' % policy)
+
+def _round_shift(x, shift, rounding='floor'):
+    """
+    Divide integer (array) x by 2**shift and round the result with one of the
+    ROUNDING_MODES, using only integer operations:
+
+    'floor':      toward negative infinity
+    'nearest':    to the nearest integer, halves toward positive infinity
+    'convergent': to the nearest integer, halves to the even integer
+    'zero':       toward zero
+
+    >>> x = [-7, -6, -5, -3, 3, 5, 6, 7] # divided by 2: -3.5 ... 3.5
+    >>> for rounding in ROUNDING_MODES:
+    ...     print rounding, [int(_round_shift(v, 1, rounding)) for v in x]
+    floor [-4, -3, -3, -2, 1, 2, 3, 3]
+    nearest [-3, -3, -2, -1, 2, 3, 3, 4]
+    convergent [-4, -3, -2, -2, 2, 2, 3, 4]
+    zero [-3, -3, -2, -1, 1, 2, 3, 3]
+
+    >>> list(_round_shift(numpy.array(x), 1, 'convergent'))
+    [-4, -3, -2, -2, 2, 2, 3, 4]
+    """
+    if rounding == 'floor' or shift == 0:
+        return x >> shift
+    half = 1 << (shift - 1)
+    low = (1 << shift) - 1 # mask of the bits shifted out
+    if rounding == 'nearest':
+        return (x + half) >> shift
+    elif rounding == 'convergent':
+        q = (x + half) >> shift
+        return q - (((x & low) == half) & (q & 1))
+    elif rounding == 'zero':
+        return (x + (x < 0)*low) >> shift
+    else:
+        raise ValueError('unknown rounding mode: %s' % rounding)
+
 def _test_overflow(x, N):
     """
     Test if integer (array) x cannot be represented as an N bit two's complement
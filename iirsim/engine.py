@@ -0,0 +1,673 @@
+"""Block processing of input data with a filter schedule.
+
+Instead of feeding one sample at a time through the whole filter, the output
+of every node is computed for all samples at once, one node after the other.
+Nodes that are not part of a feedback loop are computed with array operations,
+only the nodes of a feedback loop have to be computed sample by sample.
+
+The input can also be a matrix with one column per input pulse, in which case
+all pulses are processed at once by independent copies of the filter.
+
+If numba is installed, the feedback loops can optionally be compiled to
+machine code (only for single input pulses).
+"""
+
+import math, collections
+import numpy
+from core import _test_overflow, _round_shift, ROUNDING_MODES
+from schedule import ADD, WRAP, SATURATE, FLOOR
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+class TraceCache():
+    """
+    Keeps the traces of all nodes of the last run of a filter.
+
+    When a cache is passed to run() or run_dual(), only the nodes that depend
+    on something that has changed since the last run (a factor, the number of
+    bits, the input data or the initial state) are computed again. All other
+    traces are taken from the cache.
+    """
+    def __init__(self):
+        """Make an empty cache."""
+        self.clear()
+
+    def clear(self):
+        """Forget the traces of the last run."""
+        self._key = None
+        self._traces = None
+        self.computed = 0 # number of nodes computed in the last run
+
+    def _clean_slots(self, schedule, xs, modes, values):
+        """Return the slots whose cached traces are still valid."""
+        if self._key is None:
+            return set()
+        (names, inputs, int_type, ops, old_xs, old_modes,
+         old_values) = self._key
+        if names != schedule.names or inputs != schedule.inputs or \
+           int_type is not schedule.int_type or modes != old_modes or \
+           any(x.shape != old_x.shape for (x, old_x) in zip(xs, old_xs)):
+            return set()
+
+        changed = set(op[1] for op in schedule.ops if op != ops[op[1]])
+        for (v, old_v) in zip(values, old_values):
+            changed.update(slot for slot in range(len(names))
+                           if v[slot] != old_v[slot])
+        if any(not numpy.array_equal(x, old_x)
+               for (x, old_x) in zip(xs, old_xs)):
+            changed.add(schedule.in_slot)
+
+        # everything reading from a changed node changes as well
+        readers = [[] for name in names]
+        for (slot, slot_inputs) in enumerate(inputs):
+            for i in slot_inputs:
+                readers[i].append(slot)
+        pending = list(changed)
+        while pending:
+            for slot in readers[pending.pop()]:
+                if slot not in changed:
+                    changed.add(slot)
+                    pending.append(slot)
+        return set(range(len(names))) - changed
+
+    def _store(self, schedule, xs, modes, values, traces):
+        """Store the traces of a run."""
+        ops = dict((op[1], op) for op in schedule.ops)
+        self._key = (schedule.names, schedule.inputs, schedule.int_type, ops,
+                     xs, modes, values)
+        self._traces = traces
+
+class OverflowStats():
+    """
+    Collects overflow statistics of the input node and the Add and Multiply
+    nodes.
+
+    When an OverflowStats object is passed to run() or run_dual(), the values
+    of these nodes before they are wrapped to their number of bits are examined
+    for all samples. The statistics add up over several runs until clear() is
+    called, the sample indices continue from one run to the next. Without an
+    OverflowStats object, nothing is examined.
+    """
+    def __init__(self):
+        """Make empty statistics."""
+        self.clear()
+
+    def clear(self):
+        """Forget all statistics."""
+        self.samples = 0 # number of samples examined
+        self._nodes = {} # name -> [bits, count, first, min, max]
+
+    def report(self):
+        """
+        Return the statistics as a structured array, one element per node.
+
+        The fields are name, bits, count (number of values that overflowed),
+        first (index of the first sample with an overflow, -1 if none), min,
+        max (smallest and largest value before wrapping) and headroom (number
+        of bits that could be removed without overflow, negative if bits were
+        missing).
+
+        >>> stats = OverflowStats()
+        >>> stats._record('a', 4, numpy.array([3, 9, -2, 12]))
+        >>> stats.samples = 4
+        >>> r = stats.report()
+        >>> (r['count'][0], r['first'][0], r['min'][0], r['max'][0])
+        (2, 1, -2.0, 12.0)
+        >>> r['headroom'][0]
+        -1
+        """
+        dtype = [('name', object), ('bits', int), ('count', int),
+                 ('first', int), ('min', float), ('max', float),
+                 ('headroom', int)]
+        rows = []
+        for name in sorted(self._nodes):
+            (bits, count, first, low, high) = self._nodes[name]
+            rows.append((name, bits, count, first, low, high,
+                         bits - _needed_bits(low, high)))
+        return numpy.array(rows, dtype=dtype)
+
+    def _record(self, name, bits, values):
+        """Examine the values of a node for samples starting at self.samples.
+
+        values is a vector or a matrix with one column per input pulse.
+        """
+        if not values.size:
+            return
+        if name not in self._nodes:
+            self._nodes[name] = [bits, 0, -1, numpy.inf, -numpy.inf]
+        node = self._nodes[name]
+        node[0] = bits
+        overflow = _test_overflow(values, bits)
+        count = numpy.count_nonzero(overflow)
+        if count:
+            node[1] += count
+            if node[2] < 0:
+                rows = overflow.reshape(len(overflow), -1).any(axis=1)
+                node[2] = self.samples + int(rows.argmax())
+        node[3] = min(node[3], float(values.min()))
+        node[4] = max(node[4], float(values.max()))
+
+def run(schedule, x, ideal=False, native=False, cache=None, stats=None):
+    """
+    Return the output of the filter for the input x and the final state.
+
+    x[0] must be the value currently stored in the input node, the Delay nodes
+    start with their currently stored values (see Schedule.load()). The output
+    for x[0] is not part of the returned output, which has len(x)-1 values.
+    If x is a matrix, each column is processed independently, starting from
+    the same state, and the output is a matrix as well.
+
+    The final state is a dictionary of (slot, value) pairs for the Delay
+    nodes, holding their output values at the last sample (one value per
+    column if x is a matrix).
+
+    If native is True and numba is available, the feedback loops are compiled
+    to machine code.
+
+    If a TraceCache is given, traces from the previous run are reused where
+    possible and the traces of this run are stored in it.
+
+    If an OverflowStats object is given, the statistics of this run (except
+    for x[0]) are added to it.
+
+    The output is the same as when feeding the samples one by one, bit for
+    bit, also with feedback loops, rounding and overflows:
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> m = Multiply(8, 6, 5, 29, rounding='nearest') # 0.90625
+    >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8, 'saturate')}
+    >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+    >>> filt = Filter(nodes, adjacency, 'x', 'y')
+    >>> data = [40, -90, 100, 0, 0, -7, 0, 0, 120]
+    >>> filt.response(data, 12)
+    [40, -54, 51, 46, 42, 31, 28, 25, 127, 115, 104, 94]
+    >>> filt.response_block(data, 12).tolist() == filt.response(data, 12)
+    True
+    >>> y = filt.response_batch(numpy.array([data, data]).T, 12)
+    >>> y[:, 1].tolist() == filt.response(data, 12)
+    True
+    >>> filt.set_overflow('wrap')
+    >>> filt.set_rounding('convergent')
+    >>> filt.response_block(data, 12).tolist() == filt.response(data, 12)
+    True
+    >>> (filt.response_block(data, 12, ideal=True).tolist() ==
+    ...  filt.response(data, 12, ideal=True))
+    True
+
+    Products wider than 63 bits are computed with Python integers:
+
+    >>> nodes = {'x': Const(48), 'm': Multiply(48, 20, 18), 'y': Add(48)}
+    >>> adjacency = {'x': [], 'm': ['x'], 'y': ['x', 'm']}
+    >>> filt = Filter(nodes, adjacency, 'x', 'y')
+    >>> filt.set_factor('m', 0.9, norm=True)
+    >>> y = filt.response([2**46], 1)
+    >>> y == filt.response([2**46], 1, backend='block')
+    True
+    >>> filt.response_batch([[2**46]], 1)[:, 0].tolist() == y
+    True
+
+    With a TraceCache, only the nodes affected by a change are computed again
+    (cache.computed), with the same result as a fresh simulation:
+
+    >>> nodes = {'x': Const(8), 'a': Add(8), 'd': Delay(8),
+    ...          'm': Multiply(8, 6, 5, 16), 'o': Multiply(8, 6, 5, 24)}
+    >>> adjacency = {'x': [], 'a': ['x', 'm'], 'd': ['a'], 'm': ['d'],
+    ...              'o': ['a']}
+    >>> filt = Filter(nodes, adjacency, 'x', 'o')
+    >>> def check():
+    ...     y = filt.response_block(data, 12, incremental=True).tolist()
+    ...     return (y == filt.response(data, 12), filt._trace_cache.computed)
+    >>> check()
+    (True, 5)
+    >>> filt.set_factor('o', 8)  # only the output node
+    >>> check()
+    (True, 1)
+    >>> filt.set_factor('m', -20) # the feedback loop and the output node
+    >>> check()
+    (True, 4)
+    >>> data[2] = 50
+    >>> check()
+    (True, 5)
+    >>> check()
+    (True, 0)
+    >>> filt.set_bits(10)
+    >>> check()
+    (True, 4)
+
+    Everything is computed again when the products become too wide for int64:
+
+    >>> nodes = {'x': Const(40), 'm': Multiply(40, 20, 18), 'y': Add(40)}
+    >>> filt = Filter(nodes, {'x': [], 'm': ['x'], 'y': ['x', 'm']}, 'x', 'y')
+    >>> filt.set_factor('m', 0.9, norm=True)
+    >>> data = [2**38, 5]
+    >>> check()
+    (True, 3)
+    >>> filt.set_factor_bits(30, 28)
+    >>> check()
+    (True, 3)
+    """
+    [result] = _run(schedule, [x], [ideal], native, cache, stats)
+    return result
+
+def run_dual(schedule, x_ideal, x, native=False, cache=None, stats=None):
+    """
+    Return the ideal and the fixed point output and final state, see run().
+
+    Both are computed in a single pass through the filter, the feedback loops
+    advance the ideal and the fixed point state together. x_ideal and x are
+    the input values for the ideal and the fixed point simulation. stats only
+    collects the statistics of the fixed point simulation.
+    """
+    return _run(schedule, [x_ideal, x], [True, False], native, cache, stats)
+
+# internally used functions
+#--------------------------------------------------------------------
+def _run(schedule, xs, modes, native=False, cache=None, stats=None):
+    """Run the filter for each pair of input and ideal flag in xs, modes.
+
+    stats collects the statistics of the last mode.
+    """
+    dtypes = [float if ideal else schedule.int_type for ideal in modes]
+    # object arrays must hold Python integers, not floats
+    xs = [numpy.asarray(x, dtype=(float if ideal else numpy.int64))
+          .astype(dtype, copy=False) for (x, ideal, dtype)
+          in zip(xs, modes, dtypes)]
+    shape = xs[0].shape
+    values = []
+    for ideal in modes:
+        values.append([0] * len(schedule.names))
+        schedule.load(values[-1], ideal)
+
+    components = _components(schedule.inputs)
+    # number of components still reading from each slot
+    readers = [0] * len(schedule.names)
+    for (comp, cyclic) in components:
+        for slot in _external_inputs(schedule, comp):
+            readers[slot] += 1
+
+    if cache is not None:
+        clean = cache._clean_slots(schedule, xs, modes, values)
+        cache.computed = 0
+    else:
+        clean = set()
+
+    traces = [{} for ideal in modes]
+    finals = [{} for ideal in modes]
+    delay_slots = dict((slot, in_slot)
+                       for (slot, node, bits, in_slot) in schedule.delays)
+    const_slots = set(slot for (slot, node, bits) in schedule.consts)
+    ops = dict((op[1], op) for op in schedule.ops)
+    for (comp, cyclic) in components:
+        if clean.issuperset(comp):
+            for (tr, cached) in zip(traces, cache._traces):
+                for slot in comp:
+                    tr[slot] = cached[slot]
+        elif cyclic:
+            for (tr, loop_traces) in zip(traces, _run_loop(
+                    schedule, comp, ops, delay_slots, traces, values, shape,
+                    modes, native)):
+                tr.update(loop_traces)
+        else:
+            [slot] = comp
+            for (tr, x, v, ideal, dtype) in \
+                    zip(traces, xs, values, modes, dtypes):
+                if slot == schedule.in_slot:
+                    trace = x
+                elif slot in const_slots:
+                    trace = numpy.empty(shape, dtype=dtype)
+                    trace.fill(v[slot])
+                elif slot in delay_slots:
+                    trace = numpy.empty(shape, dtype=dtype)
+                    trace[0] = v[slot]
+                    trace[1:] = tr[delay_slots[slot]][:-1]
+                else:
+                    trace = _run_op(ops[slot], tr, ideal, schedule.names)
+                tr[slot] = trace
+        if cache is not None and not clean.issuperset(comp):
+            cache.computed += len(comp)
+        if stats is not None:
+            for slot in comp:
+                if slot in ops:
+                    stats._record(schedule.names[slot],
+                                  schedule.nodes[slot].bits(),
+                                  _op_sum(ops[slot], traces[-1],
+                                          modes[-1])[1:])
+        for slot in comp:
+            if slot in delay_slots:
+                for (tr, final) in zip(traces, finals):
+                    final[slot] = tr[slot][-1]
+        # free traces that are not needed anymore
+        for slot in _external_inputs(schedule, comp):
+            readers[slot] -= 1
+            if not readers[slot] and slot != schedule.out_slot and \
+               cache is None:
+                for tr in traces:
+                    del tr[slot]
+    if cache is not None:
+        cache._store(schedule, xs, modes, values, traces)
+    if stats is not None:
+        stats.samples += len(xs[-1]) - 1
+    return [(tr[schedule.out_slot][1:], final)
+            for (tr, final) in zip(traces, finals)]
+
+def _run_op(op, traces, ideal=False, names=None):
+    """Compute the output of an Add or Multiply node for all samples."""
+    S = _op_sum(op, traces, ideal)
+    if ideal:
+        return S
+    (offset, mask, overflow) = op[7:10]
+    if overflow == WRAP:
+        return ((S + offset) & mask) - offset
+    elif overflow == SATURATE:
+        return numpy.clip(S, -offset, offset - 1)
+    elif ((S < -offset) | (S >= offset)).any():
+        slot = op[1]
+        raise ValueError('overflow in node %s'
+                         % (slot if names is None else names[slot]))
+    else:
+        return S
+
+def _op_sum(op, traces, ideal=False):
+    """Compute the output of an Add or Multiply node before wrapping."""
+    (op, slot, a, b, factor, shift, scale, offset, mask, overflow,
+     rounding) = op
+    if ideal:
+        if op == ADD:
+            return traces[a] + traces[b]
+        else:
+            return traces[a]*factor / scale
+    else:
+        if op == ADD:
+            return traces[a] + traces[b]
+        else:
+            return _round_shift(traces[a]*factor, shift,
+                                ROUNDING_MODES[rounding])
+
+def _needed_bits(low, high):
+    """
+    Return the number of bits needed for two's complement numbers in the range
+    from low to high (rounded down to integers).
+
+    >>> [_needed_bits(-x, x) for x in [0, 1, 127, 128]]
+    [1, 2, 8, 9]
+    >>> _needed_bits(-128, 0)
+    8
+    """
+    if low > high:
+        return 1 # nothing recorded
+    low = int(math.floor(low))
+    high = int(math.floor(high))
+    return 1 + max(max(high, 0).bit_length(), max(-low - 1, 0).bit_length())
+
+def _run_loop(schedule, comp, ops, delay_slots, traces, values, shape, modes,
+              native=False):
+    """
+    Compute the outputs of the nodes of a feedback loop sample by sample for
+    each of the modes (ideal flags) at the same time.
+
+    ops and delay_slots map the slots of the Add and Multiply nodes to their
+    operations and the slots of the Delay nodes to their input slots.
+    """
+    native = native and numba is not None and len(shape) == 1 and \
+             schedule.int_type is not object
+    (loop, constants) = _loop_function(schedule, comp, ops, delay_slots,
+                                       modes, native,
+                                       vector=(len(shape) > 1))
+    args = [shape[0]]
+    outputs = []
+    for (tr, v, ideal, c) in zip(traces, values, modes, constants):
+        dtype = float if ideal else schedule.int_type
+        convert = float if ideal else int
+        external = [tr[slot] for slot in _external_inputs(schedule, comp)]
+        initial = [convert(v[slot]) for slot in comp if slot in delay_slots]
+        if native:
+            out = [numpy.empty(shape, dtype=dtype) for slot in comp]
+        elif len(shape) == 1:
+            # Python numbers are faster than numpy scalars
+            external = [trace.tolist() for trace in external]
+            out = [[0] * shape[0] for slot in comp]
+        else:
+            initial = [numpy.full(shape[1:], value, dtype=dtype)
+                       for value in initial]
+            out = [numpy.empty(shape, dtype=dtype) for slot in comp]
+        args += external + initial + out + c
+        outputs.append(out)
+    try:
+        loop(*args)
+    except ValueError as error:
+        # the generated loops raise the position of the node in comp
+        [position] = error.args
+        raise ValueError('overflow in node %s'
+                         % schedule.names[comp[position]])
+    return [dict((slot, numpy.asarray(trace, dtype=(float if ideal
+                                                    else schedule.int_type)))
+                 for (slot, trace) in zip(comp, out))
+            for (out, ideal) in zip(outputs, modes)]
+
+def _loop_function(schedule, comp, ops, delay_slots, modes, native=False,
+                   vector=False):
+    """
+    Return a function computing the outputs of the nodes of a feedback loop
+    and the lists of constants it needs for each mode.
+
+    The function is generated from the schedule. It computes all modes (ideal
+    flags) in the same loop. Its arguments are the number of samples followed
+    by, for each mode, the traces of the external inputs of the loop, the
+    initial values of the Delay nodes in the loop, the output traces of all
+    nodes in comp, which are filled in place, and the constants (factors and
+    bit masks). The values are numbers, or arrays (one element per column of
+    the input) if vector is True. ops and delay_slots are the same as for
+    _run_loop().
+
+    The generated functions only depend on the structure of the loop, not on
+    the slots of its nodes. The last _LOOP_CACHE_SIZE of them are cached and,
+    if native is True, compiled to machine code by numba. An overflow in a node
+    with the 'raise' policy raises a ValueError with the position of the node
+    in comp.
+
+    >>> from nodes import Const, Add, Multiply, Delay
+    >>> from filter import Filter
+    >>> nodes = {'x': Const(8)}
+    >>> adjacency = {'x': []}
+    >>> for (k, prev) in enumerate(['x', 's0', 's1']):
+    ...     (s, d, m) = ['%s%i' % (c, k) for c in 'sdm']
+    ...     nodes.update({s: Add(8), d: Delay(8), m: Multiply(8, 6, 5, k+8)})
+    ...     adjacency.update({s: [prev, m], d: [s], m: [d]})
+    >>> filt = Filter(nodes, adjacency, 'x', 's2')
+    >>> _loop_cache.clear()
+    >>> y = filt.response([64], 4, backend='block')
+    >>> y == filt.response([64], 4)
+    True
+    >>> len(_loop_cache) # the three loops share one function
+    1
+    >>> filt.set_factor('m1', 31)
+    >>> filt.set_overflow('raise', 's1')
+    >>> filt.response([127], 4, backend='block')
+    Traceback (most recent call last):
+    ...
+    ValueError: overflow in node s1
+    """
+    external = _external_inputs(schedule, comp)
+    # comp is sorted, slots are numbered in the order of evaluation
+    delays = [(slot, delay_slots[slot]) for slot in comp
+              if slot in delay_slots]
+    ops = [ops[slot] for slot in comp if slot in ops]
+
+    args = ['n']
+    constants = []
+    body = []
+    # numbers of the slots in the generated source: the positions in comp,
+    # followed by the external inputs
+    local = dict((slot, i) for (i, slot) in enumerate(comp + external))
+    for (k, ideal) in enumerate(modes):
+        # variable names: <letter><mode>_<local slot number>
+        name = lambda letter, slot: '%s%i_%i' % (letter, k, local[slot])
+        args += [name('x', slot) for slot in external] + \
+                [name('d', slot) for (slot, in_slot) in delays] + \
+                [name('y', slot) for slot in comp]
+        constants.append([])
+        for slot in external:
+            body.append('%s = %s[t]' % (name('v', slot), name('x', slot)))
+        for (slot, in_slot) in delays:
+            body.append('%s = %s' % (name('v', slot), name('d', slot)))
+        for (op, slot, a, b, factor, shift, scale, offset, mask,
+             overflow, rounding) in ops:
+            if ideal:
+                if op == ADD:
+                    expr = '%s + %s' % (name('v', a), name('v', b))
+                else:
+                    expr = '%s*%s / %s' % (name('v', a), name('f', slot),
+                                           name('c', slot))
+                    args += [name('f', slot), name('c', slot)]
+                    constants[k] += [factor, scale]
+            else:
+                if op == ADD:
+                    S = '%s + %s' % (name('v', a), name('v', b))
+                elif rounding == FLOOR:
+                    S = '((%s*%s) >> %s)' % (name('v', a), name('f', slot),
+                                             name('s', slot))
+                    args += [name('f', slot), name('s', slot)]
+                    constants[k] += [factor, shift]
+                else:
+                    S = _rounding_source(body, name, a, slot, rounding,
+                                         vector)
+                    args += [name(c, slot) for c in 'fshk']
+                    constants[k] += [factor, shift, 1 << (shift - 1),
+                                     (1 << shift) - 1]
+                (v, o) = (name('v', slot), name('o', slot))
+                if overflow == WRAP:
+                    expr = '((%s + %s) & %s) - %s' % (S, o, name('m', slot),
+                                                      o)
+                    args += [o, name('m', slot)]
+                    constants[k] += [offset, mask]
+                else:
+                    args.append(o)
+                    constants[k].append(offset)
+                    if overflow == SATURATE and vector:
+                        expr = 'numpy.clip(%s, -%s, %s - 1)' % (S, o, o)
+                    elif overflow == SATURATE:
+                        expr = 'min(max(%s, -%s), %s - 1)' % (S, o, o)
+                    else:
+                        body.append('%s = %s' % (v, S))
+                        test = '(%s < -%s) | (%s >= %s)' % (v, o, v, o)
+                        if vector:
+                            test = '(%s).any()' % test
+                        body += ['if %s:' % test,
+                                 '    raise ValueError(%i)'
+                                 % local[slot]]
+                        continue
+            body.append('%s = %s' % (name('v', slot), expr))
+        for slot in comp:
+            body.append('%s[t] = %s' % (name('y', slot), name('v', slot)))
+        for (slot, in_slot) in delays:
+            body.append('%s = %s' % (name('d', slot), name('v', in_slot)))
+
+    loop_range = 'range' if native else 'xrange'
+    source = '\n'.join(['def loop(%s):' % ', '.join(args),
+                        '    for t in %s(n):' % loop_range] +
+                       ['        ' + line for line in body])
+    key = (source, native)
+    loop = _loop_cache.pop(key, None)
+    if loop is None:
+        namespace = {'numpy': numpy}
+        exec source in namespace
+        loop = namespace['loop']
+        if native:
+            loop = numba.njit(loop)
+    _loop_cache[key] = loop
+    while len(_loop_cache) > _LOOP_CACHE_SIZE:
+        _loop_cache.popitem(last=False)
+    return (loop, constants)
+
+# generated loop functions, see _loop_function()
+_loop_cache = collections.OrderedDict()
+_LOOP_CACHE_SIZE = 256
+
+def _rounding_source(body, name, a, slot, rounding, vector=False):
+    """
+    Return the expression for the rounded product of a Multiply node in a
+    generated loop (see core._round_shift), appending the lines computing
+    temporary values to body. The constants are the factor (f), the shift
+    (s), half of the last bit shifted out (h) and the mask of the bits shifted
+    out (k).
+    """
+    (p, q) = (name('p', slot), name('q', slot))
+    (f, s, h, k) = [name(c, slot) for c in 'fshk']
+    mode = ROUNDING_MODES[rounding]
+    if mode == 'nearest':
+        return '((%s*%s + %s) >> %s)' % (name('v', a), f, h, s)
+    body.append('%s = %s*%s' % (p, name('v', a), f))
+    if mode == 'zero':
+        if vector:
+            return '((%s + (%s < 0)*%s) >> %s)' % (p, p, k, s)
+        return '((%s + (%s if %s < 0 else 0)) >> %s)' % (p, k, p, s)
+    body.append('%s = (%s + %s) >> %s' % (q, p, h, s))
+    if vector:
+        return '(%s - (((%s & %s) == %s) & (%s & 1)))' % (q, p, k, h, q)
+    return '(%s - (%s & 1) if (%s & %s) == %s else %s)' % (q, q, p, k, h, q)
+
+def _external_inputs(schedule, comp):
+    """Return the slots outside of comp that nodes in comp read from."""
+    members = set(comp)
+    return sorted(set(i for slot in comp for i in schedule.inputs[slot]
+                      if i not in members))
+
+def _components(inputs):
+    """
+    Return the strongly connected components of the graph given by inputs
+    (list of input slots for each slot) in an order in which each component
+    comes after the components it reads from, together with a flag telling
+    whether the component contains a loop.
+
+    >>> _components([[], [0, 3], [1], [2]])
+    [([0], False), ([1, 2, 3], True)]
+    >>> _components([[1], [1], []])
+    [([1], True), ([0], False), ([2], False)]
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    result = []
+    for root in range(len(inputs)):
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            (v, i) = work[-1]
+            if not i:
+                index[v] = low[v] = len(index)
+                stack.append(v)
+                on_stack.add(v)
+            descend = False
+            while i < len(inputs[v]):
+                w = inputs[v][i]
+                i += 1
+                if w not in index:
+                    work[-1] = (v, i)
+                    work.append((w, 0))
+                    descend = True
+                    break
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            if descend:
+                continue
+            work.pop()
+            if work:
+                u = work[-1][0]
+                low[u] = min(low[u], low[v])
+            if low[v] == index[v]:
+                comp = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    comp.append(w)
+                    if w == v:
+                        break
+                comp.sort()
+                result.append((comp, len(comp) > 1 or v in inputs[v]))
+    return result
@@ -1,4 +1,12 @@
-from nodes import _FilterNode, Const, Multiply, Delay
+import numpy
+from core import _test_overflow, _wrap
+from nodes import _FilterNode, Const, Add, Multiply, Delay
+from schedule import Schedule
+import engine, analysis
+
+# largest number of Delay nodes for which the ideal response of
+# response_dual() and response_batch() is computed from state-space matrices
+_MAX_STATE_SPACE_ORDER = 16
 
 class Filter():
     """This class makes a filter out of individual filter nodes."""
@@ -28,32 +36,99 @@ class Filter():
             input_nodes = [self._nodes[n] for n in self._adjacency[name]]
             node.connect(input_nodes)
 
-    def _update(self, ideal=False):
-        """Update all Delay nodes."""
-        for node in self._delay_nodes:
-            node.sample(ideal)
-        for node in self._delay_nodes:
-            node.clk()
+        self._in_name = in_node
+        self._out_name = out_node
+        self._schedule = None
+        self._values_mode = None # ideal flag the values were computed with
+        self._trace_cache = None
+        self._get_schedule()
+
+    def _get_schedule(self, check=True):
+        """Return the evaluation schedule, make it if necessary.
+
+        If check is True, the schedule is made again if a node has been
+        changed directly, not through the methods of the filter.
+        """
+        if check and self._schedule is not None and \
+           self._node_changes != self._count_changes():
+            self._invalidate()
+        if self._schedule is None:
+            self._schedule = Schedule(self._nodes, self._adjacency,
+                                      self._in_name, self._out_name)
+            self._node_changes = self._count_changes()
+            self._values = [0] * len(self._schedule.names)
+            self._values_mode = None
+        return self._schedule
+
+    def _count_changes(self):
+        """Return the change counters of all nodes."""
+        return [node._changes for node in self._nodes.itervalues()]
+
+    def _get_trace_cache(self, incremental=True):
+        """Return the cache for incremental runs, or None."""
+        if not incremental:
+            return None
+        if self._trace_cache is None:
+            self._trace_cache = engine.TraceCache()
+        return self._trace_cache
+
+    def _invalidate(self):
+        """Discard the schedule after factors or bits have changed."""
+        self._schedule = None
+        self._values_mode = None
 
     def reset(self):
         """Reset internal filter state."""
         self._in_node.reset()
         for node in self._delay_nodes:
             node.reset()
+        self._values_mode = None
 
     def feed(self, input_value, norm=False, ideal=False):
         """Feed new input value into the filter and return output value."""
-        self._update(ideal)
+        # the nodes are only checked for changes at the first sample
+        schedule = self._get_schedule(check=(self._values_mode is None))
+        values = self._values
+        if self._values_mode != ideal:
+            # values of the previous clock cycle are not available
+            schedule.load(values, ideal)
+            schedule.evaluate(values, ideal)
+        schedule.clock(values)
+        self._values_mode = None
         if norm:
             input_value = input_value * (1 << self._in_node._bits-1)
         if not ideal:
             input_value = int(input_value)
         self._in_node.set_value(input_value, ideal)
-        output_value = self._out_node.get_output(ideal)
+        values[schedule.in_slot] = input_value
+        schedule.evaluate(values, ideal)
+        self._values_mode = ideal
+        output_value = values[schedule.out_slot]
         if norm:
             output_value = float(output_value)/(1<<self._out_node._bits-1)
         return output_value
 
+    def fingerprint(self):
+        """Return a hashable description of structure, bits and factors.
+
+        Two filters with the same fingerprint produce the same responses.
+        """
+        nodes = []
+        for name in sorted(self._nodes.iterkeys()):
+            node = self._nodes[name]
+            description = (name, node.__class__.__name__, node.bits(),
+                           tuple(self._adjacency[name]))
+            if isinstance(node, Multiply):
+                description += (node._factor_bits, node._norm_bits,
+                                int(node.factor()), node.overflow(),
+                                node.rounding())
+            elif isinstance(node, Add):
+                description += (node.overflow(),)
+            elif isinstance(node, Const) and node is not self._in_node:
+                description += (node._value,)
+            nodes.append(description)
+        return (self._in_name, self._out_name, tuple(nodes))
+
     def print_status(self):
         """Print status message for all nodes."""
         names = self._nodes.keys()
@@ -73,8 +148,41 @@ class Filter():
                 yield 0
         return [x for x in _unit_pulse(self._in_node._bits, length, norm)]
 
-    def response(self, data, length, norm=False, ideal=False):
-        """Return the response to the input data."""
+    def response(self, data, length, norm=False, ideal=False,
+                 backend='python'):
+        """Return the response to the input data.
+
+        backend selects how the response is computed:
+        'python' -- feed the samples one by one (default)
+        'block'  -- process all samples at once, see response_block()
+        'numba'  -- like 'block', with feedback loops compiled to machine code
+                    by numba; the same as 'python' if numba is not installed
+
+        Nodes can also be changed directly, the filter notices it:
+
+        >>> from nodes import Const, Add, Multiply, Delay
+        >>> m = Multiply(8, 6, 5, 16) # 0.5
+        >>> nodes = {'x': Const(8), 'd': Delay(8), 'm': m, 'y': Add(8)}
+        >>> adjacency = {'x': [], 'd': ['y'], 'm': ['d'], 'y': ['x', 'm']}
+        >>> filt = Filter(nodes, adjacency, 'x', 'y')
+        >>> filt.response([64], 4)
+        [64, 32, 16, 8]
+        >>> m.set_factor(-16)
+        >>> filt.response([64], 4)
+        [64, -32, 16, -8]
+        >>> filt.response([64], 4, backend='block')
+        [64, -32, 16, -8]
+        """
+        if backend == 'numba' and engine.numba is None:
+            backend = 'python'
+        if backend in ['block', 'numba']:
+            self.reset()
+            x = self._input_block(data, length, norm, ideal)
+            return self._feed_block(x, norm, ideal,
+                                    native=(backend == 'numba')).tolist()
+        elif backend != 'python':
+            raise ValueError('unknown backend: %s' % backend)
+
         self.reset()
         def gen_response():
             if length > len(data):
@@ -87,6 +195,172 @@ class Filter():
                     yield self.feed(data[i], norm, ideal)
         return [x for x in gen_response()]
 
+    def response_block(self, data, length, norm=False, ideal=False,
+                       incremental=False, stats=None):
+        """Return the response to the input data as a numpy array.
+
+        The result is the same as for response(), but all samples are processed
+        at once, which is much faster for long input data.
+
+        If incremental is True, the outputs of all nodes are kept, so that the
+        next incremental call only needs to compute the nodes that are affected
+        by changed factors or bits.
+
+        If an engine.OverflowStats object is given as stats, the overflow
+        statistics of the input node and the Add and Multiply nodes are added
+        to it. Input values that do not fit into the input node are then
+        wrapped and counted instead of raising a ValueError.
+        """
+        self.reset()
+        x = self._input_block(data, length, norm, ideal, stats)
+        return self._feed_block(x, norm, ideal, incremental=incremental,
+                                stats=stats)
+
+    def process(self, chunk, norm=False, ideal=False, stats=None):
+        """Feed a chunk of input data and return the output as numpy array.
+
+        Unlike response(), the filter is not reset, it continues from the state
+        left by the previous call. Feeding the input data in several chunks
+        after reset() gives the same output as response(). stats has the same
+        meaning as for response_block(), the sample indices continue from
+        chunk to chunk.
+        """
+        x = self._input_block(chunk, len(chunk), norm, ideal, stats)
+        return self._feed_block(x, norm, ideal, stats=stats)
+
+    def get_state(self):
+        """Return the internal filter state.
+
+        The state is a dictionary with the current input value ('input') and
+        a dictionary of (name, value) pairs for the Delay nodes ('delays').
+        """
+        return {'input': self._in_node.get_output(ideal=True),
+                'delays': dict((name, node._value)
+                               for (name, node) in self._nodes.iteritems()
+                               if isinstance(node, Delay))}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state()."""
+        self._in_node.set_value(state['input'], ideal=True)
+        for (name, value) in state['delays'].iteritems():
+            node = self._nodes[name]
+            node._value = node._next_value = value
+        self._values_mode = None
+
+    def response_dual(self, data, length, norm=False, incremental=False,
+                      stats=None):
+        """Return the ideal and the fixed point response and their difference.
+
+        The same as response_block() with ideal=True and ideal=False, but
+        faster: the ideal response is computed from the state-space matrices
+        of the filter (see analysis.ideal_response), so it can differ from the
+        one of response_block() by rounding errors. If the filter has too many
+        Delay nodes or other nonzero Const nodes than the input node, both
+        responses are computed in a single pass instead.
+
+        Returns three numpy arrays: the ideal response, the fixed point
+        response and the fixed point minus the ideal response. The filter is
+        left in the fixed point state.
+        incremental and stats have the same meaning as for response_block(),
+        stats only collects the statistics of the fixed point response.
+        """
+        self.reset()
+        x_ideal = self._input_block(data, length, norm, True)
+        x = self._input_block(data, length, norm, False, stats)
+        previous = numpy.zeros(1)
+        cache = self._get_trace_cache(incremental)
+        if self._linear():
+            y_ideal = analysis.ideal_response(self, x_ideal)
+            (y, final) = engine.run(self._get_schedule(),
+                                    numpy.concatenate([previous, x]),
+                                    cache=cache, stats=stats)
+        else:
+            [(y_ideal, final_ideal), (y, final)] = engine.run_dual(
+                self._get_schedule(), numpy.concatenate([previous, x_ideal]),
+                numpy.concatenate([previous, x]), cache=cache, stats=stats)
+        self._set_block_state(x, final)
+        if norm:
+            y_ideal = y_ideal / float(1 << self._out_node._bits-1)
+            y = y.astype(float) / (1 << self._out_node._bits-1)
+        return (y_ideal, y, y - y_ideal)
+
+    def response_batch(self, data, length, norm=False, ideal=False):
+        """Return the responses to the columns of the input data matrix.
+
+        Each column is treated as a separate input pulse and filtered as by
+        response_block(), starting from the reset filter state. All columns
+        are processed at once. Returns a length-by-m matrix for an n-by-m input
+        matrix. The ideal responses are computed like in response_dual().
+        """
+        self.reset()
+        data = numpy.asarray(data)
+        if data.ndim != 2:
+            raise ValueError("input data must be a matrix")
+        x = self._input_block(data, length, norm, ideal)
+        if ideal and self._linear():
+            y = analysis.ideal_response(self, x)
+        else:
+            previous = numpy.zeros((1, x.shape[1]))
+            (y, final) = engine.run(self._get_schedule(),
+                                    numpy.concatenate([previous, x]), ideal)
+        if norm:
+            y = y.astype(float) / (1 << self._out_node._bits-1)
+        return y
+
+    def _linear(self):
+        """Return True if the ideal response can be computed from the
+        state-space matrices (see analysis.ideal_response)."""
+        return len(self._delay_nodes) <= _MAX_STATE_SPACE_ORDER and \
+               all(node._value == 0 for node in self._nodes.itervalues()
+                   if isinstance(node, Const) and node is not self._in_node)
+
+    def _input_block(self, data, length, norm=False, ideal=False,
+                     stats=None):
+        """Return the input data as array of input node values.
+
+        If stats is given, the input values are recorded in it and wrapped
+        instead of raising a ValueError if they overflow.
+        """
+        data = numpy.asarray(data, dtype=float)
+        x = numpy.zeros((length,) + data.shape[1:])
+        n = min(length, len(data))
+        x[:n] = data[:n]
+        if norm:
+            x = x * (1 << self._in_node._bits-1)
+        if not ideal:
+            x = x.astype(numpy.int64)
+        bits = self._in_node._bits
+        if stats is not None:
+            stats._record(self._in_name, bits, x)
+            if not ideal:
+                x = _wrap(x, bits)
+        elif not ideal and _test_overflow(x, bits).any():
+            raise ValueError("input overflow")
+        return x
+
+    def _feed_block(self, x, norm=False, ideal=False, native=False,
+                    incremental=False, stats=None):
+        """Feed an array of input node values into the filter."""
+        schedule = self._get_schedule()
+        previous = numpy.array([self._in_node.get_output(ideal)])
+        (y, final) = engine.run(schedule, numpy.concatenate([previous, x]),
+                                ideal, native,
+                                self._get_trace_cache(incremental), stats)
+        self._set_block_state(x, final, ideal)
+        if norm:
+            y = y.astype(float) / (1 << self._out_node._bits-1)
+        return y
+
+    def _set_block_state(self, x, final, ideal=False):
+        """Store the state after feeding x as returned by engine.run()."""
+        convert = float if ideal else int
+        for (slot, value) in final.iteritems():
+            node = self._schedule.nodes[slot]
+            node._value = node._next_value = convert(value)
+        if len(x):
+            self._in_node.set_value(convert(x[-1]), ideal)
+        self._values_mode = None
+
     def bits(self):
         """Return the number of bits for all nodes."""
         bits_list = [node.bits() for node in self._nodes.itervalues()]
@@ -101,6 +375,7 @@ class Filter():
         """Set the number of bits for all nodes."""
         for node in self._nodes.itervalues():
             node.set_bits(bits)
+        self._invalidate()
 
     def factor_bits(self):
         """Return names of the Multiply nodes with their factor_bits."""
@@ -118,6 +393,7 @@ class Filter():
         """Set factor and normalization bits for all Multiply nodes."""
         for node in [self._nodes[name] for name in self._mul_node_names]:
             node.set_factor_bits(factorbits, normbits)
+        self._invalidate()
 
     def set_factor(self, name, factor, norm=False):
         """Set the factor of a Multiply node."""
@@ -126,9 +402,56 @@ class Filter():
         except KeyError:
             raise KeyError('no node named %s' % name)
         mul_node.set_factor(factor, norm)
+        self._invalidate()
 
     def factors(self, norm=False):
         """Return names of the Multiply nodes with their factors."""
         return dict((name, self._nodes[name].factor(norm))
                      for name in self._mul_node_names)
 
+    def overflow(self):
+        """Return names of the Add and Multiply nodes with their overflow
+        policies."""
+        return dict((name, node.overflow())
+                    for (name, node) in self._nodes.iteritems()
+                    if isinstance(node, (Add, Multiply)))
+
+    def set_overflow(self, policy, name=None):
+        """Set the overflow policy of one Add or Multiply node, or of all of
+        them if name is None.
+
+        'wrap':     two's complement wrap around (default)
+        'saturate': limit to the smallest or largest possible value
+        'raise':    stop the simulation with a ValueError. The block engines
+                    report the first overflowing node in the order they are
+                    processed, not necessarily the first overflow in time.
+        """
+        if name is None:
+            nodes = [node for node in self._nodes.itervalues()
+                     if isinstance(node, (Add, Multiply))]
+        elif isinstance(self._nodes.get(name), (Add, Multiply)):
+            nodes = [self._nodes[name]]
+        else:
+            raise KeyError('no Add or Multiply node named %s' % name)
+        for node in nodes:
+            node.set_overflow(policy)
+        self._invalidate()
+
+    def rounding(self):
+        """Return names of the Multiply nodes with their rounding modes."""
+        return dict((name, self._nodes[name].rounding())
+                    for name in self._mul_node_names)
+
+    def set_rounding(self, rounding, name=None):
+        """Set the rounding mode ('floor', 'nearest', 'convergent' or 'zero')
+        of one Multiply node, or of all of them if name is None."""
+        if name is None:
+            names = self._mul_node_names
+        elif name in self._mul_node_names:
+            names = [name]
+        else:
+            raise KeyError('no Multiply node named %s' % name)
+        for n in names:
+            self._nodes[n].set_rounding(rounding)
+        self._invalidate()
+
@@ -1,7 +1,7 @@
-import os, numpy
+import os, threading, numpy
 from PyQt4 import QtCore, QtGui, Qwt5
 
-from . import cfg
+from . import cfg, cache, analysis, plotdata
 
 
 #--------------------------------------------------
@@ -136,14 +136,14 @@ class InputSettings(QtGui.QWidget):
         QtGui.QWidget.__init__(self)
 
         self.last_filename = None
-        self.data_from_file = None
+        self.pulses = None
 
         self.input_type_combo = QtGui.QComboBox()
         self.input_type_combo.addItems(['Unit pulse', 'Custom pulse'])
 
         self.file_select = FileSelect('input data file', \
             'Load pulse from file', 'Save filtered pulse to file', \
-            'Pulse files (*.pul)')
+            'Pulse files (*.pul *.bpul)')
 
         self.pulse_index = QtGui.QSpinBox()
         self.pulse_index.setRange(1, 1)
@@ -223,9 +223,17 @@ class InputSettings(QtGui.QWidget):
         filename = self.get_settings()['pulse_file']
         if not (filename == self.last_filename):
             try:
-                self.data_from_file = cfg.read_data(filename)
+                self.pulses = cfg.PulseFile(filename)
                 self.last_filename = filename
-                num_pulses = self.data_from_file.shape[1]
+                norm_bits = self.pulses.norm_bits
+                if norm_bits is not None: # stored in binary pulse files
+                    for widget in [self.input_norm, self.norm_bits]:
+                        widget.blockSignals(True)
+                    self.input_norm.setChecked(False)
+                    self.norm_bits.setValue(norm_bits)
+                    for widget in [self.input_norm, self.norm_bits]:
+                        widget.blockSignals(False)
+                num_pulses = len(self.pulses)
                 success = True
             except IOError:
                 num_pulses = 1
@@ -253,9 +261,9 @@ class InputSettings(QtGui.QWidget):
         index = settings['pulse_index']
         input_norm = settings['input_norm']
         norm_bits = settings['norm_bits']
-        data = self.data_from_file[:, index]
+        data = self.pulses[index]
         if not input_norm: # input IS NOT normalized -> normalize it
-            data = data / (2**(norm_bits-1))
+            data = data / float(2**(norm_bits-1))
         return data
 
     def _signalChanged(self):
@@ -428,6 +436,8 @@ class FilterSettings(QtGui.QWidget):
         QtGui.QWidget.__init__(self)
 
         self.last_filename = os.path.abspath(os.path.expanduser(filename))
+        # incremented whenever a filter is loaded
+        self.generation = 0
 
         self.filter_select = FileSelect('filter definition file', \
             'Load filter from file', 'Save filter to file', \
@@ -475,6 +485,7 @@ class FilterSettings(QtGui.QWidget):
             self.bits_edit_label.setEnabled(False)
             self.sliders.setEnabled(False)
             raise
+        self.generation += 1
 
         factors     = self.filt.factors()
         bits        = self.filt.bits()
@@ -549,10 +560,16 @@ class logAxes(QtGui.QWidget):
         self.emit(QtCore.SIGNAL('stateChanged()'))
 
 
+# largest number of samples that can be simulated and plotted
+_MAX_SAMPLES = 1 << 18
+
+# number of samples simulated at once by a simulation that can be cancelled
+_CHUNK = 1 << 16
+
 class plotOptions(QtGui.QWidget):
     def __init__(self, samples=128, rate=44100, show_time=False):
         QtGui.QWidget.__init__(self)
-        self.num_samples_edit = intEdit(8, 8192)
+        self.num_samples_edit = intEdit(8, _MAX_SAMPLES)
         self.num_samples_edit.setText(str(samples))
         self.sample_rate_edit = floatEdit(1, 1e12)
         self.sample_rate_edit.setText(str(rate))
@@ -643,12 +660,36 @@ class Plot(Qwt5.QwtPlot):
             self.canvas() )
 
         self.curves = []
+        # full data of the curves, which are reduced to a min/max envelope
+        # per pixel of the current x axis range (see _decimate)
+        self.data = []
+        self.logx = False
+        self.connect(self.axisWidget(Qwt5.QwtPlot.xBottom), \
+                     QtCore.SIGNAL('scaleDivChanged()'), self._decimate)
 
     def setLogScale(self, axis):
         self.setAxisScaleEngine(axis, Qwt5.QwtLog10ScaleEngine())
+        if axis == Qwt5.QwtPlot.xBottom:
+            self.logx = True
 
     def setLinScale(self, axis):
         self.setAxisScaleEngine(axis, Qwt5.QwtLinearScaleEngine())
+        if axis == Qwt5.QwtPlot.xBottom:
+            self.logx = False
+
+    def resizeEvent(self, event):
+        Qwt5.QwtPlot.resizeEvent(self, event)
+        self._decimate()
+        self.replot()
+
+    def _decimate(self):
+        scale = self.axisScaleDiv(Qwt5.QwtPlot.xBottom)
+        (low, high) = (scale.lowerBound(), scale.upperBound())
+        bins = max(self.canvas().width(), 1)
+        for (curve, [x, y]) in zip(self.curves, self.data):
+            if high > low and (low > 0 or not self.logx):
+                (x, y) = plotdata.envelope(x, y, low, high, bins, self.logx)
+            curve.setData(x, y)
 
     def plot(self, data, colors=None):
         # detach old curves from plot
@@ -664,13 +705,128 @@ class Plot(Qwt5.QwtPlot):
                 self.curves.append(curve)
         # re-attach curves with new data in reversed order so that the first
         # item in the data list is on top
-        for (i, [x, y]) in enumerate(data):
-            self.curves[i].setData(x, y)
-            if colors is not None:
-                self.curves[i].setPen(QtGui.QPen(colors[i]))
+        self.data = data
+        # setAxisScale() only takes effect with updateAxes(), the scale
+        # division read by _decimate() is invalid until then
+        self.updateAxes()
+        self._decimate()
+        if colors is not None:
+            for (i, curve) in enumerate(self.curves):
+                curve.setPen(QtGui.QPen(colors[i]))
         for curve in reversed(self.curves):
             curve.attach(self)
 
+def simulate(data, filt, options, response_cache=None, cancelled=None):
+    """Compute the responses and spectra that FilterResponsePlot shows.
+
+    Does not touch any widget, so that it can run in a worker thread. Returns
+    a dictionary of plot data and axis labels for
+    FilterResponsePlot.plotResult().
+
+    cancelled is a function that is called between chunks of _CHUNK samples
+    of long simulations and between the steps of the computation. If it
+    returns True, the computation stops and None is returned.
+    """
+    use_unit_pulse = (data is None)
+
+    length        = options['num_samples']
+    fs            = options['sample_rate']
+    time          = options['time_checked']
+    spectrum_norm = options['spectrum_norm']
+    logy_pulse    = options['logy_pulse']
+    logy_spectrum = options['logy_spectrum']
+    # a preview simulates fewer samples, shown on the axes of the full plot
+    axis_length   = options.get('axis_samples', length)
+
+    duration = (axis_length-1)/fs
+    fftlen = (length+1)/2
+    t = numpy.arange(length)
+    f = numpy.arange(1, fftlen)*fs/length
+
+    time_label = 'Samples'
+    if time:
+        prefix = ''
+        if 10*duration < 1:
+            duration = 1000*duration
+            prefix = 'm'
+        if 10*duration < 1:
+            duration = 1000*duration
+            prefix = 'u'
+        if 10*duration < 1:
+            duration = 1000*duration
+            prefix = 'n'
+        t = t*duration/(axis_length-1)
+        time_label = 'Time / %ss' % prefix
+    else:
+        duration = axis_length-1
+
+    if use_unit_pulse:
+        x = numpy.array(filt.unit_pulse(length, norm=True))
+    else:
+        x = plotdata.pad(data, length)
+
+    if cancelled is not None and length > _CHUNK:
+        compute = lambda: _chunked_responses(filt, x, cancelled)
+    else:
+        incremental = response_cache is not None
+        compute = lambda: filt.response_dual(x, length, True, incremental)
+    if response_cache is None:
+        responses = compute()
+    else:
+        responses = response_cache.response_dual( \
+                        filt, x, length, True, compute=compute)
+    if responses is None or (cancelled is not None and cancelled()):
+        return None
+    (y_id, y) = responses[:2]
+
+    # the ideal spectrum follows from the transfer function, without
+    # truncating the impulse response
+    H = analysis.frequency_response(filt, f, fs)
+    (X, Y, Y_id) = plotdata.spectra(x, y, H, spectrum_norm)
+
+    impulse_plot_data = [[t, y], [t, y_id]]
+    frequency_plot_data = [[f, Y], [f, Y_id]]
+    if not use_unit_pulse:
+        impulse_plot_data.append([t, x])
+    if not spectrum_norm:
+        frequency_plot_data.append([f, X])
+
+    minval = 1.0 / 2**(filt.bits()-1)
+    if logy_pulse:
+        for data in impulse_plot_data:
+            data[1] = plotdata.decibels(data[1], minval)
+    if logy_spectrum:
+        for data in frequency_plot_data:
+            data[1] = plotdata.decibels(data[1])
+
+    return dict([ \
+        ['impulse', impulse_plot_data], \
+        ['frequency', frequency_plot_data], \
+        ['time_label', time_label], \
+        ['time_max', duration], \
+        ['time_step', float(duration)/(axis_length-1)], \
+        ['minval', minval] ])
+
+def _chunked_responses(filt, x, cancelled):
+    """Return the same as filt.response_dual(x, len(x), True), computed in
+    chunks, or None as soon as cancelled() returns True."""
+    responses = []
+    for ideal in [True, False]:
+        if ideal and filt._linear():
+            # from the state-space matrices, much faster than in chunks
+            responses.append(filt.response_batch(x[:, None], len(x),
+                                                 True, True)[:, 0])
+            continue
+        filt.reset()
+        chunks = []
+        for start in range(0, len(x), _CHUNK):
+            if cancelled():
+                return None
+            chunks.append(filt.process(x[start:start+_CHUNK], True, ideal))
+        responses.append(numpy.concatenate(chunks))
+    (y_id, y) = responses
+    return (y_id, y, y - y_id)
+
 class FilterResponsePlot(QtGui.QWidget):
     def __init__(self):
         QtGui.QWidget.__init__(self)
@@ -685,75 +841,28 @@ class FilterResponsePlot(QtGui.QWidget):
         vbox.addWidget(self.frequency_plot, 1)
         self.setLayout(vbox)
 
-    def replot(self, data, filt, options):
-        use_unit_pulse = (data is None)
-
-        length        = options['num_samples']
+    def plotResult(self, result, options):
         fs            = options['sample_rate']
-        time          = options['time_checked']
-        input_norm    = options['input_norm']
         spectrum_norm = options['spectrum_norm']
         logx_pulse    = options['logx_pulse']
         logy_pulse    = options['logy_pulse']
         logx_spectrum = options['logx_spectrum']
         logy_spectrum = options['logy_spectrum']
 
-        duration = (length-1)/fs
-        fftlen = (length+1)/2
-        t = numpy.arange(length)
-        f = numpy.linspace(1, fftlen, fftlen)*fs/2/fftlen
+        impulse_plot_data = result['impulse']
+        frequency_plot_data = result['frequency']
+        t_max = result['time_max']
         xaxis = Qwt5.QwtPlot.xBottom
         yaxis = Qwt5.QwtPlot.yLeft
 
-        if time:
-            prefix = ''
-            if 10*duration < 1:
-                duration = 1000*duration
-                prefix = 'm'
-            if 10*duration < 1:
-                duration = 1000*duration
-                prefix = 'u'
-            if 10*duration < 1:
-                duration = 1000*duration
-                prefix = 'n'
-            t = t*duration/(length-1)
-            self.impulse_plot.setAxisTitle(xaxis, 'Time / %ss' % prefix)
-        else:
-            self.impulse_plot.setAxisTitle(xaxis, 'Samples')
-
-        if use_unit_pulse:
-            x = numpy.array(filt.unit_pulse(length, norm=True))
-        else:
-            x = data
-            if len(x) > length:
-                x = x[:length]
-            while len(x) < length:
-                x = numpy.append(x, 0.0)
-
-        [y_id, y] = [numpy.array( \
-                     filt.response(x, length, True, ideal)) \
-                     for ideal in [True, False]]
-
-        X = numpy.abs(numpy.fft.fft(x)[1:fftlen])
-        [Y_id, Y] = \
-            [numpy.abs(numpy.fft.fft(data)[1:fftlen]) for data in [y_id, y]]
-        if spectrum_norm:
-            Y_id = Y_id/X
-            Y    = Y   /X
-
-        impulse_plot_data = [[t, y], [t, y_id]]
-        frequency_plot_data = [[f, Y], [f, Y_id]]
-        if not use_unit_pulse:
-            impulse_plot_data.append([t, x])
-        if not spectrum_norm:
-            frequency_plot_data.append([f, X])
+        self.impulse_plot.setAxisTitle(xaxis, result['time_label'])
 
         if logx_pulse:
             self.impulse_plot.setLogScale(xaxis)
-            self.impulse_plot.setAxisScale(xaxis, t[1], t[length-1])
+            self.impulse_plot.setAxisScale(xaxis, result['time_step'], t_max)
         else:
             self.impulse_plot.setLinScale(xaxis)
-            self.impulse_plot.setAxisScale(xaxis, 0, t[length-1])
+            self.impulse_plot.setAxisScale(xaxis, 0, t_max)
 
         if logx_spectrum:
             self.frequency_plot.setLogScale(xaxis)
@@ -763,15 +872,9 @@ class FilterResponsePlot(QtGui.QWidget):
             self.frequency_plot.setAxisScale(xaxis, 0, fs/2)
 
         if logy_pulse:
-            minval = 1.0 / 2**(filt.bits()-1)
-            self.impulse_plot.setAxisScale(yaxis, 20*numpy.log10(minval), 0)
+            self.impulse_plot.setAxisScale(yaxis, \
+                float(plotdata.decibels(result['minval'])), 0)
             self.impulse_plot.setAxisTitle(yaxis, 'Amplitude / dBFS')
-            for (i, data) in enumerate(impulse_plot_data):
-                d = data[1]
-                for j in range(len(d)):
-                    if d[j] <= 0:
-                        d[j] = minval
-                impulse_plot_data[i][1] = 20*numpy.log10(d)
         else:
             self.impulse_plot.setAxisScale(yaxis, -1, 1)
             self.impulse_plot.setAxisTitle(yaxis, 'Amplitude')
@@ -782,9 +885,6 @@ class FilterResponsePlot(QtGui.QWidget):
                 self.frequency_plot.setAxisTitle(yaxis, 'Gain / dB')
             else:
                 self.frequency_plot.setAxisTitle(yaxis, 'Spectral density / dB')
-            for (i, data) in enumerate(frequency_plot_data):
-                d = data[1]
-                frequency_plot_data[i][1] = 20*numpy.log10(d)
         else:
             self.frequency_plot.setAxisScale(yaxis, 0, 30)
             if spectrum_norm:
@@ -801,10 +901,167 @@ class FilterResponsePlot(QtGui.QWidget):
         self.frequency_plot.replot()
 
 
+#--------------------------------------------------
+# Simulation Thread
+#--------------------------------------------------
+
+class SimulationThread(QtCore.QThread):
+    """Run the simulations for the plots outside of the GUI thread.
+
+    submit() queues a job and returns immediately. Only the newest job is
+    kept: a job that is still waiting when a newer one is submitted is
+    dropped, and a job that is running is cancelled (see simulate()), its
+    result is not plotted. Results are sent with the signal
+    resultReady(PyQt_PyObject, PyQt_PyObject) as (options, result), errors
+    of any kind with simulationFailed(QString), after which the thread goes
+    on with the next job.
+
+    The thread simulates its own copy of the filter, since the filter of the
+    GUI is changed by the sliders while a simulation is running. The copy is
+    made from a snapshot (see cfg.pack_filter) whenever a new filter is
+    loaded and otherwise only gets the bits and factors of each job, so that
+    incremental simulations and the response cache still work. The snapshot
+    only has to be submitted with the first job of a new filter, the thread
+    keeps the newest one.
+    """
+    def __init__(self):
+        QtCore.QThread.__init__(self)
+        self.response_cache = cache.ResponseCache(maxsize=16)
+        self._condition = threading.Condition()
+        self._job = None
+        self._latest = 0
+        self._stopped = False
+        self._filt = None
+        self._generation = None
+        self._snapshot = (None, None)
+
+    def submit(self, generation, snapshot, bits, factors, data, options):
+        """Queue a new simulation, superseding all previous ones.
+
+        generation changes whenever a new filter is loaded, snapshot is the
+        packed filter, or None if it has already been submitted for this
+        generation, bits and factors are its current settings.
+        """
+        with self._condition:
+            if snapshot is not None:
+                self._snapshot = (generation, snapshot)
+            self._latest += 1
+            self._job = (self._latest, generation, bits, factors, data,
+                         options)
+            self._condition.notify()
+
+    def stop(self):
+        """Stop the thread after the running job and wait for it."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._job is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                job = self._job
+                self._job = None
+            (job_id, generation, bits, factors, data, options) = job
+            try:
+                filt = self._get_filter(generation, bits, factors)
+                if self._stale(job_id):
+                    continue
+                result = simulate(data, filt, options, self.response_cache,
+                                  lambda: self._stale(job_id))
+            except (RuntimeError, ValueError) as error:
+                self._fail(job_id, str(error))
+                continue
+            except Exception as error:
+                # the thread has to keep running for later jobs, but the copy
+                # of the filter may be broken, so it is made again
+                self._generation = None
+                self._fail(job_id, '%s: %s' % (type(error).__name__, error))
+                continue
+            if result is not None and not self._stale(job_id):
+                self.emit(QtCore.SIGNAL( \
+                    'resultReady(PyQt_PyObject, PyQt_PyObject)'), \
+                    options, result)
+
+    def _fail(self, job_id, msg):
+        if not self._stale(job_id):
+            self.emit(QtCore.SIGNAL('simulationFailed(QString)'), msg)
+
+    def _stale(self, job_id):
+        with self._condition:
+            return self._stopped or job_id != self._latest
+
+    def _get_filter(self, generation, bits, factors):
+        if generation != self._generation:
+            with self._condition:
+                (self._generation, snapshot) = self._snapshot
+            self._filt = cfg.unpack_filter(snapshot)
+        for (name, value) in factors.iteritems():
+            self._filt.set_factor(name, value)
+        self._filt.set_bits(bits)
+        return self._filt
+
+
+#--------------------------------------------------
+# Replot Scheduler
+#--------------------------------------------------
+
+class ReplotScheduler(QtCore.QObject):
+    """Coalesce bursts of changes into few simulations.
+
+    changed() may be called any number of times, for example for every
+    valueChanged() of a slider that is being dragged. While changes keep
+    coming, the signal replotRequested(bool) is emitted with True (preview)
+    at most once per interval milliseconds. When there was no change for
+    settle milliseconds, it is emitted once with False (full resolution).
+    """
+    def __init__(self, interval=40, settle=250):
+        QtCore.QObject.__init__(self)
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(interval)
+        self.settle_timer = QtCore.QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(settle)
+        self._pending = False
+
+        self.connect(self.frame_timer, QtCore.SIGNAL('timeout()'), \
+                     self._signalPreview)
+        self.connect(self.settle_timer, QtCore.SIGNAL('timeout()'), \
+                     self._signalFull)
+
+    def changed(self):
+        self._pending = True
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+        self.settle_timer.start() # restarts a running timer
+
+    def cancel(self):
+        self.frame_timer.stop()
+        self.settle_timer.stop()
+        self._pending = False
+
+    def _signalPreview(self):
+        if self._pending and self.settle_timer.isActive():
+            self._pending = False
+            self.emit(QtCore.SIGNAL('replotRequested(bool)'), True)
+
+    def _signalFull(self):
+        self.cancel()
+        self.emit(QtCore.SIGNAL('replotRequested(bool)'), False)
+
+
 #--------------------------------------------------
 # Central Widget
 #--------------------------------------------------
 
+# number of samples simulated for the preview while a slider is dragged
+PREVIEW_SAMPLES = 2048
+
 class IIRSimCentralWidget(QtGui.QWidget):
     def __init__(self, status_bar=None, filter_filename=''):
         QtGui.QWidget.__init__(self)
@@ -832,6 +1089,24 @@ class IIRSimCentralWidget(QtGui.QWidget):
         self.plot_area = FilterResponsePlot()
         self.plot_data = None
 
+        # Simulation Thread
+        self.simulation = SimulationThread()
+        self.submitted_generation = None
+        self.connect(self.simulation, \
+            QtCore.SIGNAL('resultReady(PyQt_PyObject, PyQt_PyObject)'), \
+            self._showPlot)
+        self.connect(self.simulation, \
+            QtCore.SIGNAL('simulationFailed(QString)'), \
+            self._showError)
+        self.connect(QtCore.QCoreApplication.instance(), \
+            QtCore.SIGNAL('aboutToQuit()'), self.simulation.stop)
+        self.simulation.start()
+
+        # Replot Scheduler
+        self.scheduler = ReplotScheduler()
+        self.connect(self.scheduler, QtCore.SIGNAL('replotRequested(bool)'), \
+                     self._updatePlot)
+
         # Layout
         controlVBox = QtGui.QVBoxLayout()
         controlVBox.addWidget(self.input_settings_groupbox, 0)
@@ -861,7 +1136,7 @@ class IIRSimCentralWidget(QtGui.QWidget):
         self.connect(self.input_settings, QtCore.SIGNAL('saveFileSelected()'), \
                      self._saveData)
         self.connect(self.filter_settings, QtCore.SIGNAL('valueChanged()'), \
-                     self._updatePlot)
+                     self.scheduler.changed)
         self.connect(self.plot_options, QtCore.SIGNAL('editingFinished()'), \
                      self._updatePlot)
 
@@ -909,16 +1184,34 @@ class IIRSimCentralWidget(QtGui.QWidget):
             self.status_bar.clearMessage()
             self._updatePlot()
 
-    def _updatePlot(self):
+    def _updatePlot(self, preview=False):
+        if not preview:
+            # a pending change is included in this plot
+            self.scheduler.cancel()
         data = self.plot_data
         filt = self.filter_settings.get_filter()
         options = self.plot_options.get_options()
         options['input_norm'] = self.input_settings.get_settings()['input_norm']
-        try:
-            self.status_bar.clearMessage()
-            self.plot_area.replot(data, filt, options)
-        except ValueError as (msg, ):
-            self.status_bar.showMessage('Error: %s' % msg)
+        if preview and options['num_samples'] > PREVIEW_SAMPLES:
+            options['axis_samples'] = options['num_samples']
+            options['num_samples'] = PREVIEW_SAMPLES
+        self.status_bar.showMessage('Simulating...')
+        generation = self.filter_settings.generation
+        if generation != self.submitted_generation:
+            # the schedule is made again for packing, only do it once
+            snapshot = cfg.pack_filter(filt)
+            self.submitted_generation = generation
+        else:
+            snapshot = None
+        self.simulation.submit(generation, snapshot, filt.bits(), \
+                               filt.factors(), data, options)
+
+    def _showPlot(self, options, result):
+        self.status_bar.clearMessage()
+        self.plot_area.plotResult(result, options)
+
+    def _showError(self, msg):
+        self.status_bar.showMessage('Error: %s' % msg)
 
     def _saveData(self):
         raise NotImplementedError
@@ -1,5 +1,8 @@
-import math
-from core import _test_int, _test_overflow, _wrap, from_real, to_real
+from core import _test_int, _test_overflow, _limit, _round_shift, \
+                 OVERFLOW_POLICIES, ROUNDING_MODES, from_real, to_real
+
+# words for the overflow policies in verbose messages
+_PAST = {'wrap': 'wrapped', 'saturate': 'saturated'}
 
 # base class: _FilterNode
 #--------------------------------------------------------------------
@@ -10,6 +13,9 @@ class _FilterNode():
     def __init__(self, ninputs, bits):
         self._input_nodes = [None for i in range(ninputs)]
         self._ninputs = ninputs
+        self._overflow = 'wrap'
+        # incremented by every setter, so that a Filter notices the change
+        self._changes = 0
         self.set_bits(bits)
 
     def _get_input_values(self, ideal=False):
@@ -42,6 +48,18 @@ class _FilterNode():
     def set_bits(self, bits):
         """Set the number of bits."""
         self._bits = bits
+        self._changes += 1
+
+    def overflow(self):
+        """Return the overflow policy ('wrap', 'saturate' or 'raise')."""
+        return self._overflow
+
+    def set_overflow(self, policy):
+        """Set the overflow policy ('wrap', 'saturate' or 'raise')."""
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy: %s' % policy)
+        self._overflow = policy
+        self._changes += 1
 
 # Const, Add, Multiply, Delay are inherited from the _FilterNode base class
 #--------------------------------------------------------------------
@@ -72,21 +90,24 @@ class Const(_FilterNode):
 class Add(_FilterNode):
     """Adds two integer values using binary two's complement arithmetic."""
 
-    def __init__(self, bits):
-        """Set the number of bits for the inputs."""
+    def __init__(self, bits, overflow='wrap'):
+        """Set the number of bits for the inputs and the overflow policy."""
         _FilterNode.__init__(self, 2, bits)
+        self.set_overflow(overflow)
 
     def get_output(self, ideal=False, verbose=False):
-        """Return the sum of the input values using modular arithmetic."""
+        """Return the sum of the input values, reduced to the number of bits
+        according to the overflow policy."""
         input_values = self._get_input_values(ideal)
         S = sum(input_values)
         if not ideal:
-            value = _wrap(S, self._bits)
+            value = _limit(S, self._bits, self._overflow)
         else:
             value = S
         if verbose:
             if S != value:
-                msg = 'OVERFLOW: %i wrapped to %i' % (S, value)
+                msg = 'OVERFLOW: %i %s to %i' % (S, _PAST[self._overflow],
+                                                 value)
             else:
                 msg = 'returning %i' % value
             return (value, msg)
@@ -95,9 +116,13 @@ class Add(_FilterNode):
 
 class Multiply(_FilterNode):
     """Multiplies the input value by a constant factor."""
-    def __init__(self, bits, factor_bits, norm_bits, factor=0):
-        """Set the number of bits for the input, the factor and the norm."""
+    def __init__(self, bits, factor_bits, norm_bits, factor=0,
+                 overflow='wrap', rounding='floor'):
+        """Set the number of bits for the input, the factor and the norm, the
+        overflow policy and the rounding mode."""
         _FilterNode.__init__(self, 1, bits)
+        self.set_overflow(overflow)
+        self.set_rounding(rounding)
 
         self._factor_bits = factor_bits
         self._norm_bits = norm_bits
@@ -151,6 +176,7 @@ class Multiply(_FilterNode):
                              % (low, high, low_r, high_r))
         else:
             self._factor = factor
+            self._changes += 1
 
     @property
     def limits(self):
@@ -158,28 +184,39 @@ class Multiply(_FilterNode):
         limit = 1 << (self._factor_bits - 1)
         return -limit, limit - 1
 
+    def rounding(self):
+        """Return the rounding mode (see core.ROUNDING_MODES)."""
+        return self._rounding
+
+    def set_rounding(self, rounding):
+        """Set the rounding mode ('floor', 'nearest', 'convergent' or
+        'zero')."""
+        if rounding not in ROUNDING_MODES:
+            raise ValueError('unknown rounding mode: %s' % rounding)
+        self._rounding = rounding
+        self._changes += 1
+
     def set_factor_bits(self, factorbits, normbits):
         """Change the number of bits used for factor and factor norm."""
         old_factor = self.factor(norm=True)
         self._factor_bits = factorbits
         self._norm_bits = normbits
+        self._changes += 1
         self.set_factor(old_factor, norm=True)
 
     def get_output(self, ideal=False, verbose=False):
         """Return multiple of the input value."""
         [input_value] = self._get_input_values(ideal)
-        idealvalue = input_value*self._factor / 2.0**self._norm_bits
         if not ideal:
-            #P = int(round(idealvalue)) # -> nearest
-            P = int(math.floor(idealvalue)) # -> negative
-            #P = int(math.ceil(idealvalue)) # -> positive
-            #P = int(idealvalue) # -> zero
-            value = _wrap(P, self._bits)
+            P = int(_round_shift(input_value*self._factor, self._norm_bits,
+                                 self._rounding))
+            value = _limit(P, self._bits, self._overflow)
         else:
-            value = idealvalue
+            value = input_value*self._factor / 2.0**self._norm_bits
         if verbose:
             if P != value:
-                msg = 'OVERFLOW: %i wrapped to %i' % (P, value)
+                msg = 'OVERFLOW: %i %s to %i' % (P, _PAST[self._overflow],
+                                                 value)
             else:
                 msg = 'returning %i' % value
             return (value, msg)
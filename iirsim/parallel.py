@@ -0,0 +1,42 @@
+"""Distribution of independent work items to a pool of worker processes.
+
+Used by the coefficient sweep and the command line batch runner. The workers
+are prepared once by an initializer, which typically loads filters and data
+into a module level dictionary, so that only small work items have to be sent
+to them.
+"""
+
+import multiprocessing
+
+def pool_map(function, items, processes, initializer=None, initargs=(),
+             chunksize=None):
+    """
+    Return map(function, items), computed by up to processes worker processes.
+
+    initializer(*initargs) is called once in every worker process before it
+    gets any items. If processes is 1 or there are fewer than 2 items, no
+    worker processes are started and the initializer is called in this
+    process instead. function and initializer must be defined at module level
+    so that they can be sent to the worker processes. chunksize has the same
+    meaning as for multiprocessing.Pool.map().
+
+    >>> pool_map(abs, [-1, 2, -3], 2)
+    [1, 2, 3]
+    >>> pool_map(abs, [-1, 2, -3], 1)
+    [1, 2, 3]
+    """
+    if processes == 1 or len(items) < 2:
+        if initializer is not None:
+            initializer(*initargs)
+        return map(function, items)
+    pool = multiprocessing.Pool(min(processes, len(items)), initializer,
+                                initargs)
+    try:
+        results = pool.map(function, items, chunksize)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
@@ -0,0 +1,113 @@
+"""Post-processing of filter responses for the plots of the GUI.
+
+Padding of the input data, spectra, normalization, conversion to decibels and
+reduction of long curves to the points that can be seen, all on whole numpy
+arrays and without Qt, so that the time spent here can be measured separately
+from drawing the plots, for example:
+
+python -m timeit -s "import numpy; from iirsim import plotdata; \\
+    y = numpy.random.randn(10**6)" "plotdata.decibels(y, 2**-15)"
+"""
+
+import numpy
+
+def pad(x, length):
+    """
+    Return x truncated or padded with zeros to the given length.
+
+    >>> pad([1, 2, 3], 5).tolist()
+    [1.0, 2.0, 3.0, 0.0, 0.0]
+    >>> pad([1, 2, 3], 2).tolist()
+    [1.0, 2.0]
+    """
+    x = numpy.asarray(x, dtype=float)[:length]
+    result = numpy.zeros(length)
+    result[:len(x)] = x
+    return result
+
+def spectrum(x, num):
+    """
+    Return the magnitude of the discrete Fourier transform of x at the
+    frequencies 1 ... num (in units of the sample rate / len(x)).
+
+    num must be less than len(x)/2 + 1.
+
+    >>> [round(v, 6) for v in spectrum([1, 0, 0, 0], 2)]
+    [1.0, 1.0]
+    """
+    return numpy.abs(numpy.fft.rfft(x)[1:num+1])
+
+def spectra(x, y, H, norm=False):
+    """
+    Return the spectra (X, Y, Y_id) of the input x, the output y and the ideal
+    output for the frequency response H, at the len(H) lowest frequencies
+    except zero.
+
+    If norm is True, Y and Y_id are divided by X, giving the gain.
+
+    >>> (X, Y, Y_id) = spectra([1, 0, 0, 0], [1, 1, 0, 0], [2, 0])
+    >>> (X.tolist(), [round(v, 6) for v in Y], Y_id.tolist())
+    ([1.0, 1.0], [1.414214, 0.0], [2.0, 0.0])
+    """
+    H = numpy.abs(H)
+    X = spectrum(x, len(H))
+    Y = spectrum(y, len(H))
+    if norm:
+        return (X, Y/X, H)
+    else:
+        return (X, Y, H*X)
+
+def decibels(y, minval=None):
+    """
+    Return 20 log10(y).
+
+    If minval is given, values <= 0 are replaced by minval first, otherwise
+    they give -inf or nan.
+
+    >>> decibels([1, 0.1, 0, -1], 0.01).tolist()
+    [0.0, -20.0, -40.0, -40.0]
+    """
+    y = numpy.asarray(y, dtype=float)
+    if minval is not None:
+        y = numpy.where(y > 0, y, minval)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return 20*numpy.log10(y)
+
+def envelope(x, y, low, high, bins, log=False):
+    """
+    Return the points (x, y) reduced to the minimum and maximum of y in each
+    of bins equally wide intervals between x = low and x = high.
+
+    x must be sorted. The intervals are equally wide on a logarithmic axis if
+    log is True. Points outside of [low, high] are dropped except for the
+    nearest one on each side, so that lines to them still end at the edges.
+    For every interval, two points are returned at the first x value in it,
+    one with the minimum and one with the maximum of y, so that drawing the
+    result as a line looks the same as drawing all points when there is one
+    interval per pixel. If that would not give fewer points, x and y are
+    returned unchanged.
+
+    >>> (x, y) = envelope(range(8), [0, 5, 1, 4, 2, 7, 3, 6], 0, 8, 2)
+    >>> (x.tolist(), y.tolist())
+    ([0, 0, 4, 4], [0, 5, 2, 7])
+    """
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    start = max(numpy.searchsorted(x, low, 'right') - 1, 0)
+    stop = numpy.searchsorted(x, high, 'left') + 1
+    (x, y) = (x[start:stop], y[start:stop])
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if log:
+            u = numpy.log(x/float(low)) / numpy.log(float(high)/low)
+        else:
+            u = (x - low) / float(high - low)
+    interval = numpy.clip(numpy.floor(u*bins), -1, bins)
+    firsts = numpy.concatenate(
+        [[0], numpy.flatnonzero(numpy.diff(interval)) + 1])
+    if 2*len(firsts) >= len(x):
+        return (x, y)
+    x_env = numpy.repeat(x[firsts], 2)
+    y_env = numpy.column_stack([numpy.minimum.reduceat(y, firsts),
+                                numpy.maximum.reduceat(y, firsts)]).ravel()
+    return (x_env, y_env)
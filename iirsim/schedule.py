@@ -0,0 +1,205 @@
+import collections
+import numpy
+from core import _test_overflow, _round_shift, ROUNDING_MODES
+from nodes import Const, Add, Multiply, Delay
+
+# operation codes used in Schedule.ops
+ADD = 0
+MUL = 1
+
+# overflow policy codes used in Schedule.ops
+WRAP = 0
+SATURATE = 1
+RAISE = 2
+_POLICY_CODES = {'wrap': WRAP, 'saturate': SATURATE, 'raise': RAISE}
+
+# rounding mode codes used in Schedule.ops, indices in ROUNDING_MODES
+FLOOR = ROUNDING_MODES.index('floor')
+
+class Schedule():
+    """Flat, topologically sorted evaluation order of a filter graph.
+
+    Every node gets one slot in a list of values. Const and Delay nodes are
+    sources, their values are loaded from the nodes. Add and Multiply nodes are
+    listed in an order in which the inputs of each node are computed before the
+    node itself, so that every node is evaluated exactly once per clock cycle.
+
+    The number of bits, the factors, the overflow policies and the rounding
+    modes are copied from the nodes when the schedule is made, it must be made
+    again when they change (Filter does this when a node's change counter has
+    changed).
+
+    int_type is the integer type the block engine (see engine.run) uses for the
+    fixed point simulation: numpy.int64 if no sum or product can exceed 63
+    bits, otherwise Python integers (object arrays), which are slower but
+    exact.
+
+    >>> c, m, a, d = Const(8), Multiply(8, 6, 5), Add(8), Delay(8)
+    >>> nodes = {'c': c, 'm': m, 'a': a, 'd': d}
+    >>> adjacency = {'c': [], 'm': ['d'], 'a': ['c', 'm'], 'd': ['a']}
+    >>> for (name, node) in nodes.iteritems():
+    ...     node.connect([nodes[n] for n in adjacency[name]])
+    >>> s = Schedule(nodes, adjacency, 'c', 'a')
+    >>> [s.names[op[1]] for op in s.ops]
+    ['m', 'a']
+    >>> s.int_type
+    <type 'numpy.int64'>
+    >>> m.set_factor_bits(60, 5)
+    >>> Schedule(nodes, adjacency, 'c', 'a').int_type
+    <type 'object'>
+    """
+    def __init__(self, node_dict, adjacency_dict, in_node, out_node):
+        """Make the schedule for the given nodes and connections.
+
+        The arguments have the same meaning as for Filter.__init__().
+        """
+        sources = sorted(name for (name, node) in node_dict.iteritems()
+                         if isinstance(node, (Const, Delay)))
+        ordered = _topological_order(node_dict, adjacency_dict)
+
+        self.names = sources + ordered
+        self.slots = dict((name, i) for (i, name) in enumerate(self.names))
+        self.nodes = [node_dict[name] for name in self.names]
+        self.in_slot = self.slots[in_node]
+        self.out_slot = self.slots[out_node]
+        self.inputs = [[self.slots[n] for n in adjacency_dict[name]]
+                       for name in self.names]
+
+        # smallest number of bits of the nodes reading from each source
+        reader_bits = {}
+        for (slot, node) in enumerate(self.nodes):
+            for i in self.inputs[slot]:
+                reader_bits[i] = min(reader_bits.get(i, node.bits()),
+                                     node.bits())
+
+        self.consts = []
+        self.delays = []
+        for (slot, name) in enumerate(sources):
+            node = node_dict[name]
+            if isinstance(node, Const):
+                self.consts.append((slot, node, reader_bits.get(slot)))
+            else:
+                [in_slot] = self.inputs[slot]
+                self.delays.append((slot, node, reader_bits.get(slot),
+                                    in_slot))
+
+        # largest product of a Multiply node: (bits-1) + (factor_bits-1) bits
+        max_bits = max([node.bits() for node in self.nodes] + [1])
+        max_factor_bits = max([node._factor_bits for node in self.nodes
+                               if isinstance(node, Multiply)] + [1])
+        if max_bits + max_factor_bits <= 63:
+            self.int_type = numpy.int64
+        else:
+            self.int_type = object
+
+        self.ops = []
+        for name in ordered:
+            slot = self.slots[name]
+            node = node_dict[name]
+            offset = 1 << (node.bits() - 1)
+            mask = (1 << node.bits()) - 1
+            overflow = _POLICY_CODES[node.overflow()]
+            if isinstance(node, Add):
+                [a, b] = self.inputs[slot]
+                self.ops.append((ADD, slot, a, b, None, None, None,
+                                 offset, mask, overflow, None))
+            else:
+                [a] = self.inputs[slot]
+                if node._norm_bits:
+                    rounding = ROUNDING_MODES.index(node.rounding())
+                else:
+                    rounding = FLOOR # exact
+                self.ops.append((MUL, slot, a, None, int(node.factor()),
+                                 node._norm_bits, 2.0**node._norm_bits,
+                                 offset, mask, overflow, rounding))
+
+    def load(self, values, ideal=False):
+        """Copy the values stored in the Const and Delay nodes to values."""
+        for (slot, node, bits) in self.consts:
+            values[slot] = node._value
+        for (slot, node, bits, in_slot) in self.delays:
+            values[slot] = node.get_output(ideal)
+        if not ideal:
+            for (slot, node, bits) in self.consts + \
+                    [d[:3] for d in self.delays]:
+                if bits is not None and _test_overflow(values[slot], bits):
+                    raise ValueError("input overflow")
+
+    def evaluate(self, values, ideal=False):
+        """Compute the values of all Add and Multiply nodes in place."""
+        _evaluate(self.ops, values, ideal, self.names)
+
+    def clock(self, values):
+        """Store the inputs of all Delay nodes and make them their outputs."""
+        new_values = [values[in_slot]
+                      for (slot, node, bits, in_slot) in self.delays]
+        for ((slot, node, bits, in_slot), value) in \
+                zip(self.delays, new_values):
+            values[slot] = value
+            node._value = node._next_value = value
+
+# internally used functions
+#--------------------------------------------------------------------
+def _evaluate(ops, values, ideal=False, names=None):
+    """Compute the values of the operations ops (see Schedule) in place.
+
+    names are the names of the slots, used in error messages.
+    """
+    if ideal:
+        for (op, slot, a, b, factor, shift, scale, offset, mask,
+             overflow, rounding) in ops:
+            if op == ADD:
+                values[slot] = values[a] + values[b]
+            else:
+                values[slot] = values[a]*factor / scale
+    else:
+        for (op, slot, a, b, factor, shift, scale, offset, mask,
+             overflow, rounding) in ops:
+            if op == ADD:
+                S = values[a] + values[b]
+            elif rounding == FLOOR:
+                S = (values[a]*factor) >> shift # -> negative
+            else:
+                S = _round_shift(values[a]*factor, shift,
+                                 ROUNDING_MODES[rounding])
+            if overflow == WRAP:
+                values[slot] = ((S + offset) & mask) - offset
+            elif -offset <= S < offset:
+                values[slot] = S
+            elif overflow == SATURATE:
+                values[slot] = -offset if S < 0 else offset - 1
+            else:
+                raise ValueError('overflow in node %s'
+                                 % (slot if names is None else names[slot]))
+
+def _topological_order(node_dict, adjacency_dict):
+    """
+    Return the names of the Add and Multiply nodes such that each node comes
+    after the Add and Multiply nodes it reads from.
+    """
+    pending = dict((name, set(n for n in adjacency_dict[name]
+                              if isinstance(node_dict[n], (Add, Multiply))))
+                   for (name, node) in node_dict.iteritems()
+                   if isinstance(node, (Add, Multiply)))
+    readers = dict((name, []) for name in pending)
+    for (name, inputs) in pending.iteritems():
+        for n in inputs:
+            readers[n].append(name)
+
+    ready = collections.deque(sorted(name for (name, inputs)
+                                     in pending.iteritems() if not inputs))
+    order = []
+    while ready:
+        name = ready.popleft()
+        order.append(name)
+        for reader in sorted(readers[name]):
+            pending[reader].discard(name)
+            if not pending[reader]:
+                ready.append(reader)
+    if len(order) < len(pending):
+        done = set(order)
+        loop = sorted(name for name in pending if name not in done)
+        raise RuntimeError('Loop without Delay node through nodes %s' \
+                           % ', '.join(loop))
+    return order
+
@@ -0,0 +1,119 @@
+"""Evaluate a filter for many combinations of factors in parallel.
+
+The points of a grid of factor values are distributed to a pool of worker
+processes. Each worker loads the filter from the file once and computes the
+responses for every point it gets with Filter.response_dual().
+"""
+
+import itertools, multiprocessing
+import numpy
+import cfg, parallel
+
+def peak(y, y_ideal):
+    """Return the largest absolute output value."""
+    return numpy.abs(y).max()
+
+def max_error(y, y_ideal):
+    """Return the largest deviation from the ideal output."""
+    return numpy.abs(y - y_ideal).max()
+
+def rms_error(y, y_ideal):
+    """Return the root mean square deviation from the ideal output."""
+    return numpy.sqrt(numpy.mean((y - y_ideal)**2))
+
+METRICS = [('peak', peak), ('max_error', max_error), ('rms_error', rms_error)]
+
+def sweep_factors(filename, grid, data=None, length=None, metrics=METRICS,
+                  processes=None):
+    """
+    Return metrics of the filter response for each point of a factor grid.
+
+    filename:  Filter definition file (see cfg.load_filter).
+
+    grid:      Dictionary of (name, values) pairs, where name is the name of a
+               Multiply node and values is a sequence of normalized factors.
+               All combinations of the values are evaluated.
+
+    data:      Normalized input data (default: unit pulse).
+
+    length:    Number of output samples (default: length of the input data).
+
+    metrics:   List of (name, function) pairs. Each function is called with the
+               normalized fixed point and ideal response and must return a
+               number. The functions must be defined at module level so that
+               they can be sent to the worker processes.
+
+    processes: Number of worker processes (default: number of CPUs). If 1, no
+               worker processes are started.
+
+    Returns a structured array with one element per grid point and one field
+    for each Multiply node in grid and for each metric. The metrics are NaN for
+    points where a factor is out of range or an overflow occurs.
+
+    >>> import os, tempfile
+    >>> (fd, filename) = tempfile.mkstemp('.fil')
+    >>> f = os.fdopen(fd, 'w')
+    >>> f.write('bits_global 8\\nfactor_bits_global 6\\nnorm_bits_global 5\\n'
+    ...         'node Const, name "x", input\\n'
+    ...         'node Multiply, name "m", connect "x", factor 0.5, output\\n')
+    >>> f.close()
+    >>> grid = {'m': [0.5, -0.25, 1.5]} # 1.5 is out of range
+    >>> r = sweep_factors(filename, grid, [0.5, -0.25], processes=1)
+    >>> r.dtype.names
+    ('m', 'peak', 'max_error', 'rms_error')
+    >>> r[['m', 'peak', 'max_error']].tolist()
+    [(0.5, 0.25, 0.0), (-0.25, 0.125, 0.0), (1.5, nan, nan)]
+    >>> r2 = sweep_factors(filename, grid, [0.5, -0.25], processes=2)
+    >>> all(numpy.allclose(r[name], r2[name], equal_nan=True)
+    ...     for name in r.dtype.names)
+    True
+    >>> os.remove(filename)
+    """
+    names = sorted(grid.keys())
+    points = list(itertools.product(*[grid[name] for name in names]))
+    if data is None:
+        if length is None:
+            raise ValueError('length must be given for the unit pulse')
+        data = cfg.load_filter(filename).unit_pulse(length, norm=True)
+    data = numpy.asarray(data, dtype=float)
+    if length is None:
+        length = len(data)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    chunksize = max(1, len(points) // (4*processes))
+    results = parallel.pool_map(_evaluate_point, points, processes,
+                                _init_worker,
+                                (filename, names, data, length, metrics),
+                                chunksize)
+
+    dtype = [(name, float) for name in names] + \
+            [(name, float) for (name, function) in metrics]
+    return numpy.array([point + result
+                        for (point, result) in zip(points, results)],
+                       dtype=dtype)
+
+# internally used functions
+#--------------------------------------------------------------------
+_worker = {}
+
+def _init_worker(filename, names, data, length, metrics):
+    """Load the filter once per worker process."""
+    _worker['filter'] = cfg.load_filter(filename)
+    _worker['names'] = names
+    _worker['data'] = data
+    _worker['length'] = length
+    _worker['metrics'] = metrics
+
+def _evaluate_point(point):
+    """Return the metrics for one combination of factors."""
+    filt = _worker['filter']
+    metrics = _worker['metrics']
+    try:
+        for (name, factor) in zip(_worker['names'], point):
+            filt.set_factor(name, factor, norm=True)
+        (y_ideal, y) = filt.response_dual(_worker['data'], _worker['length'],
+                                          True)[:2]
+    except ValueError:
+        return tuple(numpy.nan for m in metrics)
+    return tuple(float(function(y, y_ideal)) for (name, function) in metrics)
@@ -0,0 +1,140 @@
+"""Search for the smallest word lengths that keep a filter accurate enough.
+
+The number of bits of all nodes and the factor_bits and norm_bits of all
+Multiply nodes are varied over given ranges. For every configuration, the
+responses to the input data are compared with the ideal response of the filter
+as it was given. Configurations are tried from large to small word lengths, and
+a configuration is skipped without simulating it if it is not larger in any
+respect than one that has already failed, assuming that removing bits never
+makes a filter more accurate.
+"""
+
+import numpy
+from nodes import Add, Multiply, Delay
+
+def hardware_cost(filt):
+    """
+    Return a simple estimate of the hardware cost of a filter.
+
+    Each Add and Delay node costs one unit per bit, each Multiply node costs
+    bits times factor_bits units.
+    """
+    cost = 0
+    for node in filt._nodes.itervalues():
+        if isinstance(node, (Add, Delay)):
+            cost += node.bits()
+        elif isinstance(node, Multiply):
+            cost += node.bits() * node._factor_bits
+    return cost
+
+def explore_word_lengths(filt, data, length, bits, factor_bits, norm_bits,
+                         max_error, cost=hardware_cost):
+    """
+    Return all simulated word length configurations with cost and error.
+
+    filt:        The filter. It is restored to its original configuration
+                 afterwards.
+
+    data:        Normalized input data, a vector or a matrix with one pulse per
+                 column.
+
+    length:      Number of output samples.
+
+    bits, factor_bits, norm_bits:
+                 Sequences of values to try for all nodes.
+
+    max_error:   Largest acceptable absolute deviation of the normalized output
+                 from the ideal output.
+
+    cost:        Function returning the hardware cost of a configured filter.
+
+    Returns a structured array with the fields bits, factor_bits, norm_bits,
+    cost, error and pareto, sorted by cost. error is inf if the factors cannot
+    be represented (then cost is NaN) or if the simulation raised an overflow
+    error, which happens for overflows of the input and of nodes with the
+    'raise' overflow policy. Overflows of nodes with the 'wrap' or 'saturate'
+    policy only show up as a large error. pareto is True for the
+    configurations with error <= max_error for which no other one has both
+    lower (or equal) cost and lower (or equal) error.
+
+    >>> from nodes import Const
+    >>> from filter import Filter
+    >>> nodes = {'x': Const(8), 'm': Multiply(8, 6, 5, 24), 'y': Add(8)}
+    >>> filt = Filter(nodes, {'x': [], 'm': ['x'], 'y': ['x', 'm']}, 'x', 'y')
+    >>> r = explore_word_lengths(filt, [0.3], 1, [8, 4], [6, 2], [5, 2], 0.02)
+    >>> for row in r:
+    ...     print tuple(row)[:4], round(row['error'], 6), row['pareto']
+    (4, 6, 2, 28.0) 0.15 False
+    (4, 6, 5, 28.0) 0.15 False
+    (8, 6, 2, 56.0) 0.009375 True
+    (8, 6, 5, 56.0) 0.009375 False
+    (8, 2, 2, nan) inf False
+    (8, 2, 5, nan) inf False
+
+    The factor 0.75 cannot be represented with 2 factor bits, and 4 bits with
+    2 factor bits are not tried because 8 bits with 2 factor bits failed. The
+    filter is restored:
+
+    >>> (filt.bits(), filt.factor_bits(), filt.norm_bits(), filt.factors())
+    (8, {'m': 6}, {'m': 5}, {'m': 24})
+    """
+    data = numpy.asarray(data, dtype=float)
+    data = data.reshape(len(data), -1)
+    original = _get_config(filt)
+    try:
+        y_ideal = filt.response_batch(data, length, True, True)
+
+        # (bits, integer factor bits, norm_bits), larger is more accurate
+        configs = sorted(set((b, fb - nb, nb) for b in bits
+                             for fb in factor_bits for nb in norm_bits),
+                         reverse=True)
+        failed = []
+        results = []
+        for (b, ib, nb) in configs:
+            if any(b <= f[0] and ib <= f[1] and nb <= f[2] for f in failed):
+                continue # pruned
+            _set_config(filt, original)
+            config_cost = numpy.nan
+            try:
+                filt.set_bits(b)
+                filt.set_factor_bits(ib + nb, nb)
+                config_cost = cost(filt)
+                y = filt.response_batch(data, length, True, False)
+                error = numpy.abs(y - y_ideal).max()
+            except ValueError:
+                error = numpy.inf
+            if not error <= max_error:
+                failed.append((b, ib, nb))
+            results.append((b, ib + nb, nb, config_cost, error, False))
+    finally:
+        _set_config(filt, original)
+
+    dtype = [('bits', int), ('factor_bits', int), ('norm_bits', int),
+             ('cost', float), ('error', float), ('pareto', bool)]
+    results = numpy.array(results, dtype=dtype)
+    results.sort(order=['cost', 'error'])
+    best_error = numpy.inf
+    for i in range(len(results)):
+        error = results['error'][i]
+        if error <= max_error and error < best_error:
+            results['pareto'][i] = True
+            best_error = error
+    return results
+
+# internally used functions
+#--------------------------------------------------------------------
+def _get_config(filt):
+    """Return the number of bits, factor bits, norm bits and factors."""
+    return dict((name, (node.bits(),) +
+                       ((node._factor_bits, node._norm_bits, node.factor())
+                        if isinstance(node, Multiply) else ()))
+                for (name, node) in filt._nodes.iteritems())
+
+def _set_config(filt, config):
+    """Restore a configuration returned by _get_config()."""
+    for (name, node_config) in config.iteritems():
+        node = filt._nodes[name]
+        node.set_bits(node_config[0])
+        if isinstance(node, Multiply):
+            (node._factor_bits, node._norm_bits) = node_config[1:3]
+            node.set_factor(node_config[3])